@@ -0,0 +1,91 @@
+import time
+from collections import OrderedDict
+
+# Все кэши процесса по имени - для статистики
+CACHES = {}
+
+_MISSING = object()
+
+
+class TTLCache:
+    """Кэш в памяти процесса: ограниченный размер (LRU) и время жизни записи.
+
+    Значение, прочитанное из БД до invalidate(), не попадает в кэш: set()
+    с устаревшим токеном из token() игнорируется.
+    """
+
+    def __init__(self, name: str, maxsize: int, ttl: float):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._version = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        CACHES[name] = self
+
+    def get(self, key, default=None):
+        item = self._data.get(key, _MISSING)
+        if item is _MISSING:
+            self.misses += 1
+            return default
+
+        value, expires_at = item
+        if expires_at <= time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return default
+
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def token(self):
+        """Отметка перед чтением из БД, передается в set()"""
+        return self._version
+
+    def set(self, key, value, token=None):
+        if token is not None and token != self._version:
+            # Пока читали из БД, запись изменили - не кэшируем старое
+            return
+
+        self._data[key] = (value, time.monotonic() + self.ttl)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key):
+        self._version += 1
+        self.invalidations += 1
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._version += 1
+        self.invalidations += 1
+        self._data.clear()
+
+    async def get_or_load(self, key, loader):
+        """Значение из кэша или из loader(); пустой результат не кэшируется"""
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+
+        token = self.token()
+        value = await loader()
+        if value is not None:
+            self.set(key, value, token)
+        return value
+
+    def stats(self):
+        return {
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+            'ttl': self.ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+        }
@@ -15,4 +15,76 @@ DB_PORT = os.getenv('DB_PORT')
 DATABASE_URL = f"postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
 
 # ID закройщика
-ZAKROISHCHIK_ID = int(os.getenv('ZAKROISHCHIK_ID'))
\ No newline at end of file
+ZAKROISHCHIK_ID = int(os.getenv('ZAKROISHCHIK_ID'))
+
+# Режим записи количества операторами:
+# 'set' - новое значение заменяет старое, 'increment' - прибавляется к уже записанному
+COUNT_SUBMISSION_MODE = os.getenv('COUNT_SUBMISSION_MODE', 'set')
+if COUNT_SUBMISSION_MODE not in ('set', 'increment'):
+    raise ValueError(
+        f"COUNT_SUBMISSION_MODE должен быть 'set' или 'increment', получено: {COUNT_SUBMISSION_MODE!r}"
+    )
+
+# Пул подключений к БД
+DB_POOL_MIN_SIZE = int(os.getenv('DB_POOL_MIN_SIZE', 2))
+DB_POOL_MAX_SIZE = int(os.getenv('DB_POOL_MAX_SIZE', 10))
+DB_COMMAND_TIMEOUT = float(os.getenv('DB_COMMAND_TIMEOUT', 10))
+# Сколько секунд простаивающее соединение живет в пуле (0 - бессрочно).
+# По умолчанию бессрочно: закрытое соединение при следующем открытии заново
+# готовит все выражения из STATEMENTS, а бот часто простаивает дольше пяти минут.
+# Цена - пул держит на сервере до DB_POOL_MAX_SIZE соединений и в простое;
+# если их нужно отдавать, задайте значение в секундах (например, 3600)
+DB_MAX_INACTIVE_LIFETIME = float(os.getenv('DB_MAX_INACTIVE_LIFETIME', 0))
+# После стольких запросов соединение пересоздается
+DB_MAX_QUERIES = int(os.getenv('DB_MAX_QUERIES', 50000))
+# Размер кэша подготовленных выражений на соединение (не меньше реестра STATEMENTS)
+DB_STATEMENT_CACHE_SIZE = int(os.getenv('DB_STATEMENT_CACHE_SIZE', 200))
+
+# Отложенная запись показаний (write-behind): отправки, пришедшие в пределах
+# интервала, записываются одной транзакцией. Выключено - каждая пишется сразу
+WRITE_BEHIND_ENABLED = os.getenv('WRITE_BEHIND_ENABLED', '0') == '1'
+WRITE_BEHIND_FLUSH_INTERVAL = float(os.getenv('WRITE_BEHIND_FLUSH_INTERVAL', 0.05))
+WRITE_BEHIND_MAX_BATCH = int(os.getenv('WRITE_BEHIND_MAX_BATCH', 200))
+
+# Кэш пользователей по tg_id в памяти процесса
+USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE', 1000))
+USER_CACHE_TTL = float(os.getenv('USER_CACHE_TTL', 300))
+# Незарегистрированные tg_id: короткий TTL, сбрасываются при регистрации
+UNKNOWN_USER_CACHE_SIZE = int(os.getenv('UNKNOWN_USER_CACHE_SIZE', 5000))
+UNKNOWN_USER_CACHE_TTL = float(os.getenv('UNKNOWN_USER_CACHE_TTL', 60))
+
+# Список партий и готовые клавиатуры партий; сбрасываются при изменении партий
+PARTY_CACHE_TTL = float(os.getenv('PARTY_CACHE_TTL', 600))
+# Сколько партий держать с готовыми клавиатурами цветов
+COLORS_CACHE_SIZE = int(os.getenv('COLORS_CACHE_SIZE', 200))
+# Сколько готовых текстов отчетов по партиям держать в памяти
+REPORT_CACHE_SIZE = int(os.getenv('REPORT_CACHE_SIZE', 200))
+
+# Сброс кэшей между экземплярами бота через LISTEN/NOTIFY (нужно, если
+# процессов больше одного; держит одно отдельное подключение к БД)
+CACHE_NOTIFY_ENABLED = os.getenv('CACHE_NOTIFY_ENABLED', '1') == '1'
+CACHE_NOTIFY_CHANNEL = os.getenv('CACHE_NOTIFY_CHANNEL', 'shveya_cache')
+
+# Хранилище состояний FSM: postgres - таблица fsm_states (переживает
+# перезапуск, общее для экземпляров), memory - в памяти процесса
+FSM_STORAGE = os.getenv('FSM_STORAGE', 'postgres')
+FSM_CACHE_SIZE = int(os.getenv('FSM_CACHE_SIZE', 2000))
+FSM_CACHE_TTL = float(os.getenv('FSM_CACHE_TTL', 300))
+# Предел размера данных одного состояния FSM в JSON (байт): в состоянии
+# хранятся ключи, а не строки из БД
+FSM_MAX_DATA_SIZE = int(os.getenv('FSM_MAX_DATA_SIZE', 8192))
+# Брошенные сценарии сбрасываются: ожидание ввода количества живет недолго,
+# чтобы число, набранное позже, не записалось в давно выбранный материал
+FSM_STATE_TTL = float(os.getenv('FSM_STATE_TTL', 3600))
+FSM_INPUT_STATE_TTL = float(os.getenv('FSM_INPUT_STATE_TTL', 900))
+# Фоновая очистка истекших состояний в БД: период и размер пачки
+FSM_SWEEP_INTERVAL = float(os.getenv('FSM_SWEEP_INTERVAL', 60))
+FSM_SWEEP_BATCH = int(os.getenv('FSM_SWEEP_BATCH', 500))
+# Апдейты одного пользователя выполняются по очереди; сколько их может
+# ждать сверх выполняемого - остальные отбрасываются (двойные нажатия)
+USER_QUEUE_SIZE = int(os.getenv('USER_QUEUE_SIZE', 5))
+
+# Текущая партия пользователя: кэш в памяти и отложенная запись в users.last_party_id
+SESSION_CACHE_SIZE = int(os.getenv('SESSION_CACHE_SIZE', 1000))
+SESSION_CACHE_TTL = float(os.getenv('SESSION_CACHE_TTL', 3600))
+SESSION_FLUSH_INTERVAL = float(os.getenv('SESSION_FLUSH_INTERVAL', 5))
@@ -1,474 +1,1294 @@
+import asyncio
+import json
+import time
+import uuid
+from collections import defaultdict, deque
+from datetime import date, datetime
+
 import asyncpg
-from config import DATABASE_URL
+from config import (
+    DATABASE_URL, DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE, DB_COMMAND_TIMEOUT,
+    DB_MAX_INACTIVE_LIFETIME, DB_MAX_QUERIES, DB_STATEMENT_CACHE_SIZE,
+    WRITE_BEHIND_ENABLED, WRITE_BEHIND_FLUSH_INTERVAL, WRITE_BEHIND_MAX_BATCH,
+    USER_CACHE_SIZE, USER_CACHE_TTL, UNKNOWN_USER_CACHE_SIZE, UNKNOWN_USER_CACHE_TTL,
+    PARTY_CACHE_TTL,
+    CACHE_NOTIFY_ENABLED, CACHE_NOTIFY_CHANNEL, FSM_CACHE_SIZE, FSM_CACHE_TTL,
+    FSM_MAX_DATA_SIZE, FSM_SWEEP_INTERVAL, FSM_SWEEP_BATCH,
+    SESSION_CACHE_SIZE, SESSION_CACHE_TTL, SESSION_FLUSH_INTERVAL
+)
+from cache import TTLCache, CACHES
+from roles import Role
+from states import get_state_ttl
+from storage import FSMDataTooLarge
+
+# Этапы производства: ключ этапа -> (колонка исполнителя, колонка количества) в materials
+STAGE_COLUMNS = {
+    'four_x': ('four_x', 'four_x_count'),
+    'raspash': ('raspash', 'raspash_count'),
+    'beika': ('beika', 'beika_count'),
+    'strochka': ('strochka', 'strochka_count'),
+    'gorlo': ('gorlo', 'gorlo_count'),
+    'ytyg': ('ytyg', 'ytyg_count'),
+    'otk': ('otk', 'otk_count'),
+    'ypakovka': ('ypakovka', 'ypakovka_count'),
+}
+
+# Ключ этапа -> колонка со ссылкой на исполнителя (users.id) в materials.
+# Имя в колонке исполнителя остается для отображения, поиск идет по ID
+STAGE_USER_COLUMNS = {stage: f'{stage}_user_id' for stage in STAGE_COLUMNS}
+
+# Ключ этапа -> название для отчетов
+STAGE_TITLES = {
+    'four_x': '4-х',
+    'raspash': 'Распаш',
+    'beika': 'Бейка',
+    'strochka': 'Строчка',
+    'gorlo': 'Горло',
+    'ytyg': 'Утюг',
+    'otk': 'ОТК',
+    'ypakovka': 'Упаковка',
+}
+
+# Роль -> ключ этапа; искать по user['role'], а не по строке должности
+JOB_STAGES = {
+    Role.FOUR_X: 'four_x',
+    Role.RASPASH: 'raspash',
+    Role.BEIKA: 'beika',
+    Role.STROCHKA: 'strochka',
+    Role.GORLO: 'gorlo',
+    Role.YTYG: 'ytyg',
+    Role.OTK: 'otk',
+    Role.UPAKOVKA: 'ypakovka',
+}
+
+
+# Реестр SQL-выражений: каждое готовится один раз на каждом соединении пула
+# (init-хук) и вызывается по имени, поэтому текст запроса всегда один и тот же
+STATEMENTS = {
+    # Пользователи
+    'get_user': "SELECT * FROM users WHERE tg_id = $1",
+    'get_user_by_id': "SELECT * FROM users WHERE id = $1",
+    'get_all_users': "SELECT * FROM users ORDER BY name",
+    # Текущая партия пользователя (сессия)
+    'get_last_party': """
+        SELECT p.batch_number FROM users u 
+        JOIN parties p ON p.id = u.last_party_id
+        WHERE u.tg_id = $1
+    """,
+    'set_last_parties': """
+        UPDATE users u SET last_party_id = p.id
+        FROM unnest($1::bigint[], $2::text[]) AS s(tg_id, batch_number)
+        LEFT JOIN parties p ON p.batch_number = s.batch_number
+        WHERE u.tg_id = s.tg_id
+    """,
+    'add_user': """
+        INSERT INTO users (tg_id, name, job, machine_number) 
+        VALUES ($1, $2, $3, $4)
+    """,
+    'delete_user': "DELETE FROM users WHERE id = $1 RETURNING tg_id",
+    'rename_user': "UPDATE users SET name = $1 WHERE tg_id = $2",
+    'update_user_machine_number': "UPDATE users SET machine_number = $1 WHERE tg_id = $2",
+
+    # Партии
+    'get_all_parties': "SELECT * FROM parties ORDER BY batch_number",
+    'get_party_by_id': "SELECT * FROM parties WHERE id = $1",
+    'get_party_by_number': "SELECT * FROM parties WHERE batch_number = $1",
+    'get_party_id_by_number': "SELECT id FROM parties WHERE batch_number = $1",
+    'add_party': """
+        INSERT INTO parties (batch_number, design) 
+        VALUES ($1, $2)
+        RETURNING id
+    """,
+    'update_party_design': "UPDATE parties SET design = $1 WHERE batch_number = $2 RETURNING id",
+    'import_parties': """
+        INSERT INTO parties (batch_number, design)
+        SELECT * FROM unnest($1::varchar[], $2::varchar[])
+        ON CONFLICT (batch_number) DO NOTHING
+        RETURNING id
+    """,
+    'get_parties_by_numbers': "SELECT id, batch_number FROM parties WHERE batch_number = ANY($1::varchar[])",
+    'delete_party': "DELETE FROM parties WHERE batch_number = $1",
+
+    # Материалы
+    'get_materials_by_party': """
+        SELECT * FROM materials 
+        WHERE party_id = $1 
+        ORDER BY id
+    """,
+    'get_material_by_party_and_color': """
+        SELECT * FROM materials 
+        WHERE party_id = $1 AND color = $2
+    """,
+    'get_material_by_id': "SELECT * FROM materials WHERE id = $1",
+    # Партия, её материалы и машинка 4-х оператора одним запросом;
+    # у партии без материалов - одна строка с пустыми полями материала
+    'get_party_report': """
+        SELECT p.batch_number, p.design AS party_design, m.*, 
+               four_x_user.machine_number AS four_x_machine
+        FROM parties p
+        LEFT JOIN materials m ON m.party_id = p.id
+        LEFT JOIN users four_x_user ON four_x_user.id = m.four_x_user_id
+        WHERE p.id = $1
+        ORDER BY m.id
+    """,
+    'get_materials_count_by_party': "SELECT COUNT(*) FROM materials WHERE party_id = $1",
+    'get_materials_count': "SELECT COUNT(*) FROM materials WHERE party_id IN (SELECT id FROM parties)",
+    'add_material': """
+        INSERT INTO materials 
+        (party_id, color, quantity_line, tshirt_count) 
+        VALUES ($1, $2, $3, $4)
+    """,
+    'update_material_color': "UPDATE materials SET color = $1 WHERE id = $2 RETURNING party_id",
+    'delete_material': "DELETE FROM materials WHERE id = $1 RETURNING party_id",
+
+    # Журнал работ
+    'get_user_stage_total': """
+        SELECT COALESCE(SUM(count), 0) FROM work_entries 
+        WHERE user_id = $1 AND stage = $2
+    """,
+    # В режиме increment колонки этапа - сумма всех работников, а исполнитель -
+    # последний отправивший, поэтому свои показания работник видит по журналу
+    'parties_by_journal': """
+        SELECT p.* FROM parties p
+        WHERE EXISTS (
+            SELECT 1 FROM materials m JOIN work_entries w ON w.material_id = m.id
+            WHERE m.party_id = p.id AND w.stage = $1 AND w.user_id = $2
+        )
+        ORDER BY p.batch_number
+    """,
+    'party_materials_by_journal': """
+        SELECT m.*, SUM(w.count) AS own_count
+        FROM materials m JOIN work_entries w ON w.material_id = m.id
+        WHERE m.party_id = $1 AND w.stage = $2 AND w.user_id = $3
+        GROUP BY m.id
+        ORDER BY m.id
+    """,
+    'get_user_material_stage_total': """
+        SELECT COALESCE(SUM(count), 0) FROM work_entries 
+        WHERE material_id = $1 AND stage = $2 AND user_id = $3
+    """,
+    'get_party_work_summary': """
+        SELECT u.name AS worker, w.stage, m.id AS material_id, m.color, 
+               SUM(w.count) AS count
+        FROM materials m
+        JOIN work_entries w ON w.material_id = m.id
+        JOIN users u ON u.id = w.user_id
+        WHERE m.party_id = $1
+        GROUP BY u.name, w.stage, m.id, m.color
+        HAVING SUM(w.count) <> 0
+        ORDER BY u.name, w.stage, m.id
+    """,
+
+    # Состояния FSM (storage.PostgresStorage): data хранится как JSON-текст,
+    # ttl_left - сколько секунд состоянию осталось жить. Истекшая строка
+    # считается отсутствующей, а при перезаписи её state и data не наследуются
+    'fsm_get': """
+        SELECT state, data::text AS data,
+               EXTRACT(EPOCH FROM expires_at - CURRENT_TIMESTAMP)::float8 AS ttl_left
+        FROM fsm_states 
+        WHERE storage_key = $1 AND (expires_at IS NULL OR expires_at > CURRENT_TIMESTAMP)
+    """,
+    'fsm_set_state': """
+        INSERT INTO fsm_states (storage_key, state, expires_at) 
+        VALUES ($1, $2, CURRENT_TIMESTAMP + make_interval(secs => $3))
+        ON CONFLICT (storage_key) DO UPDATE 
+        SET state = EXCLUDED.state,
+            data = CASE WHEN fsm_states.expires_at <= CURRENT_TIMESTAMP 
+                THEN '{}'::jsonb ELSE fsm_states.data END,
+            expires_at = EXCLUDED.expires_at,
+            updated_at = CURRENT_TIMESTAMP
+        RETURNING state, data::text AS data,
+                  EXTRACT(EPOCH FROM expires_at - CURRENT_TIMESTAMP)::float8 AS ttl_left
+    """,
+    'fsm_set_data': """
+        INSERT INTO fsm_states (storage_key, data, expires_at) 
+        VALUES ($1, $2::jsonb, CURRENT_TIMESTAMP + make_interval(secs => $3))
+        ON CONFLICT (storage_key) DO UPDATE 
+        SET data = EXCLUDED.data,
+            state = CASE WHEN fsm_states.expires_at <= CURRENT_TIMESTAMP 
+                THEN NULL ELSE fsm_states.state END,
+            expires_at = EXCLUDED.expires_at,
+            updated_at = CURRENT_TIMESTAMP
+        RETURNING state, data::text AS data,
+                  EXTRACT(EPOCH FROM expires_at - CURRENT_TIMESTAMP)::float8 AS ttl_left
+    """,
+    'fsm_delete': "DELETE FROM fsm_states WHERE storage_key = $1",
+    'fsm_sweep': """
+        DELETE FROM fsm_states WHERE storage_key IN (
+            SELECT storage_key FROM fsm_states 
+            WHERE expires_at <= CURRENT_TIMESTAMP
+            LIMIT $1
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING storage_key
+    """,
+
+    # Служебные
+    'check_tables': "SELECT table_name FROM information_schema.tables WHERE table_schema = 'public'",
+}
+
+# Выражения по этапам строятся только из белого списка колонок STAGE_COLUMNS
+for _stage, (_worker_column, _count_column) in STAGE_COLUMNS.items():
+    _user_column = STAGE_USER_COLUMNS[_stage]
+    # Одно выражение на запись: обновление materials + запись в журнал работ.
+    # $1 - исполнитель (NULL - оставить прежнего), $2 - количество, $3 - ID материала,
+    # $4 - increment: количество для журнала, set: 0 - не писать в журнал, $5 - tg_id работника.
+    # Колонки materials обновляются для совместимости (экраны партий); статистика
+    # по работникам считается только по журналу work_entries
+    _update = f"""
+            UPDATE materials 
+            SET {_worker_column} = COALESCE($1, {_worker_column}), 
+                {_user_column} = CASE WHEN $1 IS NULL THEN {_user_column} 
+                    ELSE (SELECT id FROM users WHERE tg_id = $5) END,
+                {_count_column} = {{count_expr}} 
+            WHERE id = $3
+            RETURNING *
+    """
+    STATEMENTS[f'record_{_stage}_increment'] = f"""
+        WITH updated AS ({_update.format(count_expr=f'COALESCE({_count_column}, 0) + $2')}), entry AS (
+            INSERT INTO work_entries (material_id, stage, user_id, count)
+            SELECT updated.id, '{_stage}', users.id, $4
+            FROM updated JOIN users ON users.tg_id = $5
+            WHERE $4 <> 0
+        )
+        SELECT * FROM updated
+    """
+    # В режиме set в журнал идет разница с тем, что этот же работник уже
+    # записал по материалу: повторная отправка 50, затем 55 дает в журнале 55,
+    # а не 105. Отправка другого работника добавляет его собственное количество,
+    # записи прежнего работника не трогаются
+    STATEMENTS[f'record_{_stage}_set'] = f"""
+        WITH updated AS ({_update.format(count_expr='$2')}), entry AS (
+            INSERT INTO work_entries (material_id, stage, user_id, count)
+            SELECT material_id, '{_stage}', user_id, count FROM (
+                SELECT updated.id AS material_id, users.id AS user_id, $2 - COALESCE((
+                    SELECT SUM(w.count) FROM work_entries w
+                    WHERE w.material_id = updated.id AND w.stage = '{_stage}' AND w.user_id = users.id
+                ), 0) AS count
+                FROM updated JOIN users ON users.tg_id = $5
+            ) changes
+            WHERE $4 <> 0 AND count <> 0
+        )
+        SELECT * FROM updated
+    """
+    STATEMENTS[f'materials_by_worker_{_stage}'] = f"""
+        SELECT * FROM materials 
+        WHERE {_user_column} = $1 AND {_count_column} > 0
+    """
+    STATEMENTS[f'parties_by_worker_{_stage}'] = f"""
+        SELECT p.* FROM parties p
+        WHERE EXISTS (SELECT 1 FROM materials m WHERE m.party_id = p.id AND m.{_user_column} = $1)
+        ORDER BY p.batch_number
+    """
+    STATEMENTS[f'party_materials_by_worker_{_stage}'] = f"""
+        SELECT * FROM materials 
+        WHERE party_id = $1 AND {_user_column} = $2 AND {_count_column} IS NOT NULL
+        ORDER BY id
+    """
+
+
+def _fsm_json_default(value):
+    """Данные FSM в JSON: строки из БД - словарями, даты - строками ISO"""
+    if isinstance(value, asyncpg.Record):
+        return dict(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"Тип {type(value).__name__} нельзя сохранить в состоянии FSM")
+
+
+class PreparedConnection(asyncpg.Connection):
+    """Соединение пула, на котором выражения из STATEMENTS готовятся заранее.
+
+    Подготовленные выражения хранятся в собственном кэше asyncpg (по тексту
+    запроса), поэтому переживают возврат соединения в пул.
+
+    Использует внутренние _prepare и _stmt_cache asyncpg (версия закреплена
+    в requirements.txt). Если их не окажется, прогрев пропускается, а
+    выражения готовятся при первом вызове как обычно.
+    """
+
+    async def prepare_statements(self):
+        if not hasattr(self, '_prepare') or not hasattr(self, '_stmt_cache'):
+            print("⚠️ Эта версия asyncpg не поддерживает прогрев выражений - пропускаем")
+            return
+
+        for name, query in STATEMENTS.items():
+            try:
+                await self._prepare(query, use_cache=True)
+            except asyncpg.PostgresError as e:
+                # Например, таблицы ещё нет - выражение подготовится при первом вызове
+                print(f"⚠️ Не удалось подготовить выражение {name}: {e}")
+
+    def is_prepared(self, query: str) -> bool:
+        try:
+            return self._stmt_cache.has((query, self._protocol.get_record_class(), False))
+        except (AttributeError, TypeError):
+            return False
+
+
+class OperationWriteQueue:
+    """Очередь отложенной записи показаний (write-behind).
+
+    Отправки, пришедшие в пределах flush_interval, записываются одной
+    транзакцией через fetchmany - на пачку уходит одно соединение из пула.
+    Каждый отправитель получает свою обновленную строку материала.
+    """
+
+    def __init__(self, database, flush_interval: float, max_batch: int):
+        self.database = database
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self._pending = []
+        self._has_items = asyncio.Event()
+        self._full = asyncio.Event()
+        self._task = None
+        self._closing = False
+        self.batches = 0
+        self.items = 0
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def submit(self, name: str, args):
+        """Поставить выражение в очередь и дождаться результата"""
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((name, args, future))
+        self._has_items.set()
+        if len(self._pending) >= self.max_batch:
+            self._full.set()
+        return await future
+
+    async def _run(self):
+        while not self._closing:
+            await self._has_items.wait()
+            if not self._closing:
+                try:
+                    await asyncio.wait_for(self._full.wait(), self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+            await self.flush()
+
+    async def flush(self):
+        """Записать всё накопленное одной транзакцией"""
+        batch, self._pending = self._pending, []
+        self._has_items.clear()
+        self._full.clear()
+        if not batch:
+            return
+
+        # Порядок внутри одного выражения сохраняется - инкременты
+        # одного материала применяются в порядке отправки
+        groups = defaultdict(list)
+        for item in batch:
+            groups[item[0]].append(item)
+
+        try:
+            results = []
+            async with self.database.acquire() as conn:
+                async with conn.transaction():
+                    for name, items in groups.items():
+                        rows = await self.database.fetchmany(
+                            name, [args for _, args, _ in items], conn=conn
+                        )
+                        results.append((items, rows))
+        except Exception as e:
+            print(f"⚠️ Пачка из {len(batch)} записей не прошла ({e}), пишем по одной")
+            await self._write_one_by_one(batch)
+            return
+
+        self.batches += 1
+        self.items += len(batch)
+
+        for items, rows in results:
+            # Строк может быть меньше, чем отправок (материал удален) -
+            # сопоставляем по ID материала в порядке выполнения
+            rows_by_material = defaultdict(deque)
+            for row in rows:
+                rows_by_material[row['id']].append(row)
+
+            for _, args, future in items:
+                material_rows = rows_by_material[args[2]]
+                if not future.done():
+                    future.set_result(material_rows.popleft() if material_rows else None)
+
+    async def _write_one_by_one(self, batch):
+        for name, args, future in batch:
+            try:
+                row = await self.database.fetchrow(name, *args)
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+            else:
+                if not future.done():
+                    future.set_result(row)
+
+    async def close(self):
+        """Остановить фоновую запись и дописать остаток"""
+        self._closing = True
+        self._has_items.set()
+        self._full.set()
+        if self._task is not None:
+            await self._task
+            self._task = None
+        await self.flush()
+
+
+class SessionWriter:
+    """Отложенная запись текущих партий пользователей в users.last_party_id.
+
+    Для каждого пользователя хранится только последний выбор; раз в
+    flush_interval все накопленное пишется одним UPDATE.
+    """
+
+    def __init__(self, database, flush_interval: float):
+        self.database = database
+        self.flush_interval = flush_interval
+        self.pending = {}
+        self._task = None
+        self._closing = False
+        self._wakeup = asyncio.Event()
+        self.batches = 0
+        self.items = 0
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    def submit(self, tg_id: int, batch_number):
+        self.pending[tg_id] = batch_number
+
+    async def _run(self):
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            await self.flush()
+
+    async def flush(self):
+        if not self.pending:
+            return
+
+        batch, self.pending = self.pending, {}
+        try:
+            await self.database.execute(
+                'set_last_parties', list(batch), [batch[tg_id] for tg_id in batch]
+            )
+        except Exception as e:
+            print(f"⚠️ Не удалось сохранить текущие партии ({len(batch)}), повторим позже: {e}")
+            # Более новый выбор, сделанный во время записи, не перетираем
+            for tg_id, batch_number in batch.items():
+                self.pending.setdefault(tg_id, batch_number)
+            return
+
+        self.batches += 1
+        self.items += len(batch)
+        if self.database.invalidation_channel is not None:
+            for tg_id in batch:
+                self.database.invalidation_channel.publish('session', tg_id)
+
+    async def close(self):
+        self._closing = True
+        self._wakeup.set()
+        if self._task is not None:
+            await self._task
+            self._task = None
+        await self.flush()
+
+
+class FsmSweeper:
+    """Фоновое удаление истекших состояний FSM пачками.
+
+    Несколько экземпляров бота чистят таблицу параллельно: строки,
+    которые уже удаляет другой, пропускаются (SKIP LOCKED).
+    """
+
+    def __init__(self, database, interval: float, batch_size: int):
+        self.database = database
+        self.interval = interval
+        self.batch_size = batch_size
+        self._task = None
+        self._closing = False
+        self._wakeup = asyncio.Event()
+        self.sweeps = 0
+        self.reclaimed = 0
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            if self._closing:
+                break
+
+            try:
+                await self.sweep()
+            except Exception as e:
+                print(f"⚠️ Очистка истекших состояний не удалась: {e}")
+
+    async def sweep(self):
+        """Удалить все истекшие состояния; возвращает их количество"""
+        total = 0
+        while True:
+            rows = await self.database.fetch('fsm_sweep', self.batch_size)
+            for row in rows:
+                self.database._invalidate('fsm', row['storage_key'])
+            total += len(rows)
+            if len(rows) < self.batch_size:
+                break
+
+        self.sweeps += 1
+        self.reclaimed += total
+        if total:
+            print(f"🧹 Сброшено брошенных сценариев: {total}")
+        return total
+
+    async def close(self):
+        self._closing = True
+        self._wakeup.set()
+        if self._task is not None:
+            await self._task
+            self._task = None
+
+
+class CacheInvalidationChannel:
+    """Сброс кэшей между экземплярами бота через LISTEN/NOTIFY.
+
+    Держит отдельное подключение: слушает канал и отправляет в него свои
+    события пачками. Свои же уведомления отбрасываются по origin. Если
+    подключение оборвалось, события могли потеряться - тогда кэши
+    сбрасываются целиком, а подключение восстанавливается.
+    """
+
+    # Лимит NOTIFY - 8000 байт, события отправляются частями
+    EVENTS_PER_NOTIFY = 100
+
+    def __init__(self, database, channel: str, reconnect_interval: float = 5):
+        self.database = database
+        self.channel = channel
+        self.reconnect_interval = reconnect_interval
+        self.origin = uuid.uuid4().hex
+        self._conn = None
+        self._pending = {}
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._closing = False
+        self.sent = 0
+        self.received = 0
+
+    async def start(self):
+        await self._connect()
+        self._task = asyncio.create_task(self._run())
+
+    async def _connect(self):
+        self._conn = await asyncpg.connect(DATABASE_URL)
+        await self._conn.add_listener(self.channel, self._on_notify)
+        self._conn.add_termination_listener(self._on_terminated)
+
+    def publish(self, kind: str, key=None):
+        # Повторы одного события до отправки схлопываются
+        self._pending[(kind, key)] = None
+        self._wakeup.set()
+
+    def _on_notify(self, conn, pid, channel, payload):
+        try:
+            message = json.loads(payload)
+        except ValueError:
+            print(f"⚠️ Некорректное уведомление в канале {channel}: {payload[:100]}")
+            return
+
+        if message.get('origin') == self.origin:
+            return
+
+        for kind, key in message.get('events', []):
+            self.database._apply_invalidation(kind, key)
+            self.received += 1
+
+    def _on_terminated(self, conn):
+        if not self._closing:
+            print("⚠️ Подключение для сброса кэшей оборвалось, кэши сброшены")
+            self.database.reset_caches()
+            self._wakeup.set()
+
+    async def _run(self):
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.reconnect_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+            if self._conn is None or self._conn.is_closed():
+                if self._closing or not await self._reconnect():
+                    continue
+
+            await self.flush()
+
+    async def _reconnect(self):
+        try:
+            await self._connect()
+        except (OSError, asyncpg.PostgresError) as e:
+            print(f"⚠️ Не удалось переподключиться для сброса кэшей: {e}")
+            return False
+
+        # Пока подключения не было, чужие события не приходили
+        self.database.reset_caches()
+        print("✅ Подключение для сброса кэшей восстановлено")
+        return True
+
+    async def flush(self):
+        # Без подключения события ждут переподключения - иначе другие
+        # экземпляры так и не узнают об изменениях
+        if not self._pending or self._conn is None or self._conn.is_closed():
+            return
+
+        events, self._pending = list(self._pending), {}
+        for start in range(0, len(events), self.EVENTS_PER_NOTIFY):
+            chunk = events[start:start + self.EVENTS_PER_NOTIFY]
+            payload = json.dumps({'origin': self.origin, 'events': chunk})
+            try:
+                await self._conn.execute("SELECT pg_notify($1, $2)", self.channel, payload)
+            except (OSError, asyncpg.PostgresError, asyncpg.InterfaceError) as e:
+                print(f"⚠️ Не удалось отправить сброс кэшей, повторим позже: {e}")
+                for event in events[start:]:
+                    self._pending[event] = None
+                return
+            self.sent += len(chunk)
+
+    async def close(self):
+        self._closing = True
+        self._wakeup.set()
+        if self._task is not None:
+            await self._task
+            self._task = None
+        await self.flush()
+        if self._conn is not None and not self._conn.is_closed():
+            await self._conn.close()
+        self._conn = None
 
 
 class Database:
     def __init__(self):
         self.pool = None
+        # Счетчики по выражениям: hits - план уже был подготовлен на соединении
+        self.statement_stats = {name: {'hits': 0, 'misses': 0} for name in STATEMENTS}
+        self.write_queue = None
+        self.invalidation_channel = None
+        # Пользователи по tg_id: один запрос к БД на несколько обращений за апдейт
+        self.user_cache = TTLCache('users', USER_CACHE_SIZE, USER_CACHE_TTL)
+        # tg_id, которых нет в users, - чтобы не ходить в БД на каждое их сообщение
+        self.unknown_users = TTLCache('unknown_users', UNKNOWN_USER_CACHE_SIZE, UNKNOWN_USER_CACHE_TTL)
+        # Список партий; версия растет при каждом изменении партий,
+        # по ней сбрасываются клавиатуры, собранные из списка
+        self.party_cache = TTLCache('parties', 1, PARTY_CACHE_TTL)
+        self.parties_version = 0
+        # Версия состава материалов (цветов) по партиям - для клавиатур цветов
+        self.materials_versions = defaultdict(int)
+        # Версия данных партии для отчетов: растет при любой записи в её материалы.
+        # workers_version - при изменениях пользователей, видимых в отчетах (машинка 4-х)
+        self.party_versions = defaultdict(int)
+        self.workers_version = 0
+        # Состояния FSM по ключу хранилища: (state, data как JSON-текст,
+        # момент истечения по time.monotonic() или None)
+        self.fsm_cache = TTLCache('fsm_states', FSM_CACHE_SIZE, FSM_CACHE_TTL)
+        self.fsm_sweeper = None
+        # Состояния, истекшие к моменту чтения (раньше, чем до них дошла очистка)
+        self.fsm_expired_on_read = 0
+        # Текущая партия (номер) по tg_id; '' - партия не выбрана
+        self.session_cache = TTLCache('sessions', SESSION_CACHE_SIZE, SESSION_CACHE_TTL)
+        self.session_writer = None
 
     async def create_pool(self):
-        self.pool = await asyncpg.create_pool(DATABASE_URL)
-        print("Подключение к базе данных установлено")
+        """Открыть пул при запуске: min_size соединений создаются сразу,
+        и на каждом заранее готовятся выражения из STATEMENTS"""
+        if self.pool is not None:
+            return
+
+        self.pool = await asyncpg.create_pool(
+            DATABASE_URL,
+            min_size=DB_POOL_MIN_SIZE,
+            max_size=DB_POOL_MAX_SIZE,
+            command_timeout=DB_COMMAND_TIMEOUT,
+            max_inactive_connection_lifetime=DB_MAX_INACTIVE_LIFETIME,
+            max_queries=DB_MAX_QUERIES,
+            # Кэш меньше реестра вытеснял бы заранее подготовленные выражения
+            statement_cache_size=max(DB_STATEMENT_CACHE_SIZE, len(STATEMENTS)),
+            connection_class=PreparedConnection,
+            init=self._init_connection
+        )
+        print(
+            f"Подключение к базе данных установлено "
+            f"(пул {DB_POOL_MIN_SIZE}-{DB_POOL_MAX_SIZE}, открыто: {self.pool.get_size()})"
+        )
+
+        if WRITE_BEHIND_ENABLED:
+            self.write_queue = OperationWriteQueue(
+                self, WRITE_BEHIND_FLUSH_INTERVAL, WRITE_BEHIND_MAX_BATCH
+            )
+            self.write_queue.start()
+            print(f"Отложенная запись показаний включена (интервал {WRITE_BEHIND_FLUSH_INTERVAL}с)")
+
+        self.session_writer = SessionWriter(self, SESSION_FLUSH_INTERVAL)
+        self.session_writer.start()
+
+        self.fsm_sweeper = FsmSweeper(self, FSM_SWEEP_INTERVAL, FSM_SWEEP_BATCH)
+        self.fsm_sweeper.start()
+
+        if CACHE_NOTIFY_ENABLED:
+            self.invalidation_channel = CacheInvalidationChannel(self, CACHE_NOTIFY_CHANNEL)
+            await self.invalidation_channel.start()
+            print(f"Сброс кэшей между экземплярами: канал {CACHE_NOTIFY_CHANNEL}")
+
+    async def close_pool(self):
+        # Сначала дописываем очередь, пока пул еще открыт
+        if self.write_queue is not None:
+            await self.write_queue.close()
+            self.write_queue = None
+
+        if self.session_writer is not None:
+            await self.session_writer.close()
+            self.session_writer = None
+
+        if self.fsm_sweeper is not None:
+            await self.fsm_sweeper.close()
+            self.fsm_sweeper = None
+
+        # После очереди: её записи тоже рассылают сбросы кэшей
+        if self.invalidation_channel is not None:
+            await self.invalidation_channel.close()
+            self.invalidation_channel = None
+
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+
+    def pool_stats(self):
+        """Состояние пула, очереди записи и канала сброса кэшей"""
+        stats = {}
+        if self.pool is not None:
+            stats['pool'] = {
+                'size': self.pool.get_size(),
+                'idle': self.pool.get_idle_size(),
+                'min_size': self.pool.get_min_size(),
+                'max_size': self.pool.get_max_size(),
+            }
+        if self.write_queue is not None:
+            stats['write_queue'] = {
+                'batches': self.write_queue.batches,
+                'items': self.write_queue.items,
+            }
+        if self.session_writer is not None:
+            stats['sessions'] = {
+                'batches': self.session_writer.batches,
+                'items': self.session_writer.items,
+            }
+        if self.fsm_sweeper is not None:
+            stats['fsm'] = {
+                'sweeps': self.fsm_sweeper.sweeps,
+                'reclaimed': self.fsm_sweeper.reclaimed,
+                'expired_on_read': self.fsm_expired_on_read,
+            }
+        if self.invalidation_channel is not None:
+            stats['notify'] = {
+                'sent': self.invalidation_channel.sent,
+                'received': self.invalidation_channel.received,
+            }
+        return stats
+
+    @staticmethod
+    async def _init_connection(conn):
+        await conn.prepare_statements()
+
+    def acquire(self):
+        if self.pool is None:
+            raise RuntimeError("Пул подключений не создан: вызовите db.create_pool() при запуске")
+        return self.pool.acquire()
+
+    async def _run(self, method: str, name: str, args, conn=None):
+        query = STATEMENTS[name]
+
+        if conn is None:
+            async with self.acquire() as conn:
+                return await self._run(method, name, args, conn)
+
+        stats = self.statement_stats[name]
+        if conn.is_prepared(query):
+            stats['hits'] += 1
+        else:
+            stats['misses'] += 1
+
+        return await getattr(conn, method)(query, *args)
+
+    async def execute(self, name: str, *args, conn=None):
+        return await self._run('execute', name, args, conn)
+
+    async def fetch(self, name: str, *args, conn=None):
+        return await self._run('fetch', name, args, conn)
+
+    async def fetchrow(self, name: str, *args, conn=None):
+        return await self._run('fetchrow', name, args, conn)
+
+    async def fetchval(self, name: str, *args, conn=None):
+        return await self._run('fetchval', name, args, conn)
+
+    async def fetchmany(self, name: str, args_list, conn=None):
+        return await self._run('fetchmany', name, (args_list,), conn)
+
+    def get_statement_stats(self):
+        """Статистика кэша подготовленных выражений (только использованные)"""
+        return {
+            name: dict(stats) for name, stats in self.statement_stats.items()
+            if stats['hits'] or stats['misses']
+        }
+
+    # === Сброс кэшей: в этом процессе и в остальных экземплярах бота ===
+    def _apply_invalidation(self, kind: str, key=None):
+        """Сбросить локальные кэши по событию (своему или из другого процесса)"""
+        if kind == 'user':
+            self.user_cache.invalidate(key)
+            self.unknown_users.invalidate(key)
+            self.workers_version += 1
+        elif kind == 'parties':
+            self.parties_version += 1
+            self.party_cache.clear()
+        elif kind == 'materials':
+            self.materials_versions[key] += 1
+            self.party_versions[key] += 1
+        elif kind == 'party':
+            self.party_versions[key] += 1
+        elif kind == 'fsm':
+            self.fsm_cache.invalidate(key)
+        elif kind == 'session':
+            self.session_cache.invalidate(key)
+
+    def _invalidate(self, kind: str, key=None):
+        self._apply_invalidation(kind, key)
+        if self.invalidation_channel is not None:
+            self.invalidation_channel.publish(kind, key)
+
+    def reset_caches(self):
+        """Сбросить все кэши процесса - когда события могли быть пропущены"""
+        self.workers_version += 1
+        self.parties_version += 1
+        for party_id in list(self.party_versions):
+            self.party_versions[party_id] += 1
+        for party_id in list(self.materials_versions):
+            self.materials_versions[party_id] += 1
+        for cache in CACHES.values():
+            cache.clear()
+
+    def invalidate_user(self, tg_id: int):
+        """Пользователь изменился (в отчетах видна машинка 4-х)"""
+        self._invalidate('user', tg_id)
+
+    def invalidate_parties(self):
+        """Сбросить кэш списка партий и клавиатур партий"""
+        self._invalidate('parties')
+
+    def touch_party(self, party_id: int):
+        """Данные партии изменились - сбросить её отчеты"""
+        self._invalidate('party', party_id)
+
+    def invalidate_party_materials(self, party_id: int):
+        """Состав материалов партии изменился - сбросить клавиатуры цветов и отчеты"""
+        self._invalidate('materials', party_id)
+
+    def get_party_version(self, party_id: int):
+        return self.party_versions[party_id], self.workers_version
 
     # === Методы для пользователей ===
     async def get_user(self, tg_id: int):
-        if not self.pool:
-            await self.create_pool()
-
-        async with self.pool.acquire() as conn:
-            return await conn.fetchrow(
-                "SELECT * FROM users WHERE tg_id = $1",
-                tg_id
-            )
+        """Пользователь по tg_id; роль (Role) вычисляется один раз и кэшируется вместе с ним"""
+        if self.unknown_users.get(tg_id):
+            return None
+
+        token = self.unknown_users.token()
+        user = await self.user_cache.get_or_load(tg_id, lambda: self._load_user(tg_id))
+        if user is None:
+            # Не сохраняем, если пользователь зарегистрировался, пока шел запрос
+            self.unknown_users.set(tg_id, True, token)
+        return user
+
+    async def _load_user(self, tg_id: int):
+        record = await self.fetchrow('get_user', tg_id)
+        if record is None:
+            return None
+
+        user = dict(record)
+        user['role'] = Role.from_job(user['job'])
+        return user
 
     async def add_user(self, tg_id: int, name: str, job: str, machine_number: str = None):
-        if not self.pool:
-            await self.create_pool()
+        try:
+            print(f"📝 Добавление пользователя: {name} как {job}, машинка: {machine_number}")
 
-        async with self.pool.acquire() as conn:
-            try:
-                print(f"📝 Добавление пользователя: {name} как {job}, машинка: {machine_number}")
-
-                await conn.execute(
-                    """
-                    INSERT INTO users (tg_id, name, job, machine_number) 
-                    VALUES ($1, $2, $3, $4)
-                    """,
-                    tg_id, name, job, machine_number
-                )
-                return True
-            except asyncpg.UniqueViolationError:
-                # Пользователь уже существует
-                print(f"⚠️ Пользователь {tg_id} уже существует")
-                return False
-            except Exception as e:
-                print(f"❌ Ошибка при добавлении пользователя: {e}")
-                return False
+            await self.execute('add_user', tg_id, name, job, machine_number)
+            self.invalidate_user(tg_id)
+            return True
+        except asyncpg.UniqueViolationError:
+            # Пользователь уже существует
+            print(f"⚠️ Пользователь {tg_id} уже существует")
+            return False
+        except Exception as e:
+            print(f"❌ Ошибка при добавлении пользователя: {e}")
+            return False
 
     async def get_all_users(self):
         """Получить всех пользователей"""
-        if not self.pool:
-            await self.create_pool()
-
-        async with self.pool.acquire() as conn:
-            return await conn.fetch(
-                "SELECT * FROM users ORDER BY name"
-            )
+        return await self.fetch('get_all_users')
 
     async def delete_user(self, user_id: int):
         """Удалить пользователя по ID"""
-        if not self.pool:
-            await self.create_pool()
-
-        async with self.pool.acquire() as conn:
-            await conn.execute(
-                "DELETE FROM users WHERE id = $1",
-                user_id
-            )
-            return True
+        tg_id = await self.fetchval('delete_user', user_id)
+        if tg_id is not None:
+            self.invalidate_user(tg_id)
+        return True
 
     async def get_user_by_id(self, user_id: int):
         """Получить пользователя по ID"""
-        if not self.pool:
-            await self.create_pool()
+        return await self.fetchrow('get_user_by_id', user_id)
 
-        async with self.pool.acquire() as conn:
-            return await conn.fetchrow(
-                "SELECT * FROM users WHERE id = $1",
-                user_id
-            )
+    async def rename_user(self, tg_id: int, name: str):
+        """Изменить имя пользователя"""
+        await self.execute('rename_user', name, tg_id)
+        self.invalidate_user(tg_id)
+        return True
 
+    async def update_user_machine_number(self, tg_id: int, machine_number: str):
+        """Обновить номер машинки пользователя"""
+        await self.execute('update_user_machine_number', machine_number, tg_id)
+        self.invalidate_user(tg_id)
+        return True
 
     # === Методы для партий ===
     async def get_all_parties(self):
         """Получить все партии"""
-        if not self.pool:
-            await self.create_pool()
-
-        async with self.pool.acquire() as conn:
-            return await conn.fetch(
-                "SELECT * FROM parties ORDER BY batch_number"
-            )
+        return await self.party_cache.get_or_load(
+            'all', lambda: self.fetch('get_all_parties')
+        )
 
     async def get_party_by_id(self, party_id: int):
         """Получить партию по ID"""
-        if not self.pool:
-            await self.create_pool()
-
-        async with self.pool.acquire() as conn:
-            return await conn.fetchrow(
-                "SELECT * FROM parties WHERE id = $1",
-                party_id
-            )
+        return await self.fetchrow('get_party_by_id', party_id)
 
     async def get_party_by_number(self, batch_number: str):
         """Получить партию по номеру"""
-        if not self.pool:
-            await self.create_pool()
-
-        async with self.pool.acquire() as conn:
-            return await conn.fetchrow(
-                "SELECT * FROM parties WHERE batch_number = $1",
-                batch_number
-            )
+        return await self.fetchrow('get_party_by_number', batch_number)
 
     async def add_party(self, batch_number: str, design: str = None):
         """Добавить новую партию с дизайном"""
-        if not self.pool:
-            await self.create_pool()
-
         print(f"📝 Добавление партии в БД: №{batch_number}, дизайн='{design}'")
 
-        async with self.pool.acquire() as conn:
-            try:
-                await conn.execute(
-                    """
-                    INSERT INTO parties (batch_number, design) 
-                    VALUES ($1, $2)
-                    """,
-                    batch_number, design
-                )
-                print(f"✅ Партия добавлена успешно")
-                return True
-            except asyncpg.UniqueViolationError as e:
-                print(f"⚠️ Партия уже существует: {e}")
-                return False
-            except Exception as e:
-                print(f"❌ Ошибка при добавлении партии: {e}")
-                print(f"❌ Тип ошибки: {type(e)}")
-                print(f"❌ Детали ошибки: {e.__dict__ if hasattr(e, '__dict__') else 'нет деталей'}")
-                return False
+        try:
+            party_id = await self.fetchval('add_party', batch_number, design)
+            self.invalidate_parties()
+            # Отчет, построенный до создания ("Партия не найдена"), больше не нужен
+            self.touch_party(party_id)
+            print(f"✅ Партия добавлена успешно")
+            return True
+        except asyncpg.UniqueViolationError as e:
+            print(f"⚠️ Партия уже существует: {e}")
+            return False
+        except Exception as e:
+            print(f"❌ Ошибка при добавлении партии: {e}")
+            print(f"❌ Тип ошибки: {type(e)}")
+            print(f"❌ Детали ошибки: {e.__dict__ if hasattr(e, '__dict__') else 'нет деталей'}")
+            return False
+
+    async def update_party_design(self, batch_number: str, design: str):
+        """Обновить дизайн партии"""
+        party_id = await self.fetchval('update_party_design', design, batch_number)
+        self.invalidate_parties()
+        if party_id is not None:
+            self.touch_party(party_id)
+        return True
 
     # === Методы для материалов (цветов) в партии ===
     async def get_materials_by_party(self, party_id: int):
         """Получить все материалы в партии"""
-        if not self.pool:
-            await self.create_pool()
-
-        async with self.pool.acquire() as conn:
-            return await conn.fetch(
-                """
-                SELECT * FROM materials 
-                WHERE party_id = $1 
-                ORDER BY id
-                """,
-                party_id
-            )
+        return await self.fetch('get_materials_by_party', party_id)
 
     async def get_material_by_party_and_color(self, party_id: int, color: str):
         """Получить материал по партии и цвету"""
-        if not self.pool:
-            await self.create_pool()
-
-        async with self.pool.acquire() as conn:
-            return await conn.fetchrow(
-                """
-                SELECT * FROM materials 
-                WHERE party_id = $1 AND color = $2
-                """,
-                party_id, color
-            )
+        return await self.fetchrow('get_material_by_party_and_color', party_id, color)
 
     async def delete_party(self, batch_number: str):
         """Удалить партию по номеру (каскадно удалит и материалы)"""
-        if not self.pool:
-            await self.create_pool()
-
-        async with self.pool.acquire() as conn:
-            try:
+        try:
+            async with self.acquire() as conn:
                 # Находим ID партии
-                party = await conn.fetchrow(
-                    "SELECT id FROM parties WHERE batch_number = $1",
-                    batch_number
-                )
+                party = await self.fetchrow('get_party_id_by_number', batch_number, conn=conn)
 
                 if not party:
                     return False
 
                 # Удаляем партию (каскадно удалятся все связанные материалы)
-                await conn.execute(
-                    "DELETE FROM parties WHERE batch_number = $1",
-                    batch_number
-                )
+                await self.execute('delete_party', batch_number, conn=conn)
+                self.invalidate_parties()
+                self.invalidate_party_materials(party['id'])
                 return True
-            except Exception as e:
-                print(f"❌ Ошибка при удалении партии: {e}")
-                return False
+        except Exception as e:
+            print(f"❌ Ошибка при удалении партии: {e}")
+            return False
 
     async def get_materials_count_by_party(self, party_id: int):
         """Получить количество материалов в партии"""
-        if not self.pool:
-            await self.create_pool()
+        return await self.fetchval('get_materials_count_by_party', party_id)
+
+    async def get_materials_count(self):
+        """Получить количество материалов во всех партиях"""
+        return await self.fetchval('get_materials_count')
 
-        async with self.pool.acquire() as conn:
-            return await conn.fetchval(
-                "SELECT COUNT(*) FROM materials WHERE party_id = $1",
-                party_id
-            )
-        
     async def add_material(self, party_id: int, color: str, quantity_line: int, tshirt_count: int):
         """Добавить материал в партию (для закройщика)"""
-        if not self.pool:
-            await self.create_pool()
-
-        async with self.pool.acquire() as conn:
-            try:
-                await conn.execute(
-                    """
-                    INSERT INTO materials 
-                    (party_id, color, quantity_line, tshirt_count) 
-                    VALUES ($1, $2, $3, $4)
-                    """,
-                    party_id, color, quantity_line, tshirt_count
+        try:
+            await self.execute('add_material', party_id, color, quantity_line, tshirt_count)
+            self.invalidate_party_materials(party_id)
+            return True
+        except Exception as e:
+            print(f"Ошибка при добавлении материала: {e}")
+            return False
+
+    async def import_materials(self, rows):
+        """Массовая загрузка материалов одной транзакцией через COPY.
+
+        rows - кортежи (batch_number, design, color, quantity_line, tshirt_count).
+        Недостающие партии создаются. Возвращает (новых партий, материалов).
+        """
+        designs = {}
+        for batch_number, design, *_ in rows:
+            # Для партии берем первый непустой дизайн
+            if not designs.get(batch_number):
+                designs[batch_number] = design
+
+        async with self.acquire() as conn:
+            async with conn.transaction():
+                created = await self.fetch(
+                    'import_parties', list(designs), list(designs.values()), conn=conn
                 )
-                return True
-            except Exception as e:
-                print(f"Ошибка при добавлении материала: {e}")
-                return False
-
-    async def delete_material(self, material_id: int):
-        """Удалить материал по ID"""
-        if not self.pool:
-            await self.create_pool()
-
-        async with self.pool.acquire() as conn:
-            try:
-                await conn.execute(
-                    "DELETE FROM materials WHERE id = $1",
-                    material_id
+                parties = await self.fetch('get_parties_by_numbers', list(designs), conn=conn)
+                party_ids = {party['batch_number']: party['id'] for party in parties}
+
+                await conn.copy_records_to_table(
+                    'materials',
+                    records=[
+                        (party_ids[batch_number], color, quantity_line, tshirt_count)
+                        for batch_number, _, color, quantity_line, tshirt_count in rows
+                    ],
+                    columns=('party_id', 'color', 'quantity_line', 'tshirt_count')
                 )
-                return True
-            except Exception as e:
-                print(f"❌ Ошибка при удалении материала: {e}")
-                return False
 
-    async def get_material_by_id(self, material_id: int):
-        """Получить материал по ID"""
-        if not self.pool:
-            await self.create_pool()
+        if created:
+            self.invalidate_parties()
+        for party_id in party_ids.values():
+            self.invalidate_party_materials(party_id)
 
-        async with self.pool.acquire() as conn:
-            return await conn.fetchrow(
-                "SELECT * FROM materials WHERE id = $1",
-                material_id
-            )
+        print(f"📥 Импорт: новых партий {len(created)}, материалов {len(rows)}")
+        return len(created), len(rows)
 
-    # === Методы для обновления данных по операциям ===
-    async def update_fourx(self, material_id: int, four_x: str, four_x_count: int):
-        """Обновить данные по 4-х оператору"""
-        if not self.pool:
-            await self.create_pool()
-
-        print(f"📝 UPDATE fourx:")
-        print(f"   material_id: {material_id}")
-        print(f"   four_x: '{four_x}'")
-        print(f"   four_x_count: {four_x_count}")
-
-        async with self.pool.acquire() as conn:
-            await conn.execute(
-                """
-                UPDATE materials 
-                SET four_x = $1, four_x_count = $2 
-                WHERE id = $3
-                """,
-                four_x, four_x_count, material_id
-            )
+    async def update_material_color(self, material_id: int, color: str):
+        """Изменить цвет материала"""
+        party_id = await self.fetchval('update_material_color', color, material_id)
+        if party_id is not None:
+            self.invalidate_party_materials(party_id)
+        return True
 
-        # Проверим что обновилось
-        material = await self.get_material_by_id(material_id)
-
-    async def update_raspash(self, material_id: int, raspash: str, raspash_count: int):
-        """Обновить данные по распаш"""
-        if not self.pool:
-            await self.create_pool()
-
-        async with self.pool.acquire() as conn:
-            await conn.execute(
-                """
-                UPDATE materials 
-                SET raspash = $1, raspash_count = $2 
-                WHERE id = $3
-                """,
-                raspash, raspash_count, material_id
-            )
-
-    async def update_beika(self, material_id: int, beika: str, beika_count: int):
-        """Обновить данные по бейке"""
-        if not self.pool:
-            await self.create_pool()
-
-        async with self.pool.acquire() as conn:
-            await conn.execute(
-                """
-                UPDATE materials 
-                SET beika = $1, beika_count = $2 
-                WHERE id = $3
-                """,
-                beika, beika_count, material_id
-            )
-
-    async def update_strochka(self, material_id: int, strochka: str, strochka_count: int):
-        """Обновить данные по строчке"""
-        if not self.pool:
-            await self.create_pool()
-
-        async with self.pool.acquire() as conn:
-            await conn.execute(
-                """
-                UPDATE materials 
-                SET strochka = $1, strochka_count = $2 
-                WHERE id = $3
-                """,
-                strochka, strochka_count, material_id
-            )
-
-    async def update_gorlo(self, material_id: int, gorlo: str, gorlo_count: int):
-        """Обновить данные по горлу"""
-        if not self.pool:
-            await self.create_pool()
-
-        async with self.pool.acquire() as conn:
-            await conn.execute(
-                """
-                UPDATE materials 
-                SET gorlo = $1, gorlo_count = $2 
-                WHERE id = $3
-                """,
-                gorlo, gorlo_count, material_id
-            )
-
-    async def update_ytyg(self, material_id: int, ytyg: str, ytyg_count: int):
-        """Обновить данные по утюгу"""
-        if not self.pool:
-            await self.create_pool()
-
-        async with self.pool.acquire() as conn:
-            await conn.execute(
-                """
-                UPDATE materials 
-                SET ytyg = $1, ytyg_count = $2 
-                WHERE id = $3
-                """,
-                ytyg, ytyg_count, material_id
-            )
-
-    async def update_otk(self, material_id: int, otk: str, otk_count: int):
-        """Обновить данные по ОТК"""
-        if not self.pool:
-            await self.create_pool()
-
-        async with self.pool.acquire() as conn:
-            await conn.execute(
-                """
-                UPDATE materials 
-                SET otk = $1, otk_count = $2 
-                WHERE id = $3
-                """,
-                otk, otk_count, material_id
-            )
+    async def delete_material(self, material_id: int):
+        """Удалить материал по ID"""
+        try:
+            party_id = await self.fetchval('delete_material', material_id)
+            if party_id is not None:
+                self.invalidate_party_materials(party_id)
+            return True
+        except Exception as e:
+            print(f"❌ Ошибка при удалении материала: {e}")
+            return False
 
-    async def update_ypakovka(self, material_id: int, ypakovka: str, ypakovka_count: int):
-        """Обновить данные по упаковке"""
-        if not self.pool:
-            await self.create_pool()
-
-        async with self.pool.acquire() as conn:
-            await conn.execute(
-                """
-                UPDATE materials 
-                SET ypakovka = $1, ypakovka_count = $2 
-                WHERE id = $3
-                """,
-                ypakovka, ypakovka_count, material_id
-            )
+    async def get_material_by_id(self, material_id: int):
+        """Получить материал по ID"""
+        return await self.fetchrow('get_material_by_id', material_id)
+
+    async def get_party_report(self, party_id: int):
+        """Строки отчета по партии: поля партии + материал + машинка 4-х"""
+        return await self.fetch('get_party_report', party_id)
+
+    async def get_materials_by_worker(self, stage: str, user_id: int):
+        """Материалы, где на этапе записан этот работник"""
+        return await self.fetch(f'materials_by_worker_{stage}', user_id)
+
+    async def get_parties_by_worker(self, stage: str, user_id: int):
+        """Партии, в которых работник записывал показания на этапе"""
+        return await self.fetch(f'parties_by_worker_{stage}', user_id)
+
+    async def get_party_materials_by_worker(self, stage: str, party_id: int, user_id: int):
+        """Материалы партии с показаниями работника на этапе"""
+        return await self.fetch(f'party_materials_by_worker_{stage}', party_id, user_id)
+
+    # === Журнал работ (work_entries) ===
+    async def get_user_stage_total(self, user_id: int, stage: str):
+        """Сумма по журналу работ для работника на этапе"""
+        return await self.fetchval('get_user_stage_total', user_id, stage)
+
+    async def get_parties_by_journal(self, stage: str, user_id: int):
+        """Партии, где у работника есть записи в журнале на этапе"""
+        return await self.fetch('parties_by_journal', stage, user_id)
+
+    async def get_party_materials_by_journal(self, party_id: int, stage: str, user_id: int):
+        """Материалы партии с суммой работника по журналу (own_count)"""
+        return await self.fetch('party_materials_by_journal', party_id, stage, user_id)
+
+    async def get_user_material_stage_total(self, material_id: int, stage: str, user_id: int):
+        """Сумма по журналу работ для работника по одному материалу на этапе"""
+        return await self.fetchval('get_user_material_stage_total', material_id, stage, user_id)
+
+    async def get_party_work_summary(self, party_id: int):
+        """Итоги журнала работ по партии: работник, этап, цвет, количество"""
+        return await self.fetch('get_party_work_summary', party_id)
+
+    # === Запись показаний по этапам ===
+    async def record_operation(self, stage: str, material_id: int, count: int, worker: str = None,
+                               tg_id: int = None, increment: bool = False, entry_count: int = None):
+        """Записать показания этапа одним запросом.
+
+        worker=None оставляет прежнего исполнителя (исправление количества),
+        increment=True прибавляет count к текущему значению. В журнал работ
+        (если известен tg_id) пишется: при increment - entry_count (по умолчанию
+        count), при set - разница с тем, что работник уже записал по материалу.
+        Возвращает обновленную строку материала или None, если материала нет.
+        """
+        if stage not in STAGE_COLUMNS:
+            raise ValueError(f"Неизвестный этап: {stage}")
+
+        if not increment:
+            # Разницу считает само выражение, здесь - только признак записи в журнал
+            entry_count = 1
+        elif entry_count is None:
+            entry_count = count
+        if tg_id is None:
+            entry_count = 0
+
+        mode = 'increment' if increment else 'set'
+        name = f'record_{stage}_{mode}'
+        args = (worker, count, material_id, entry_count, tg_id)
+
+        if self.write_queue is not None:
+            row = await self.write_queue.submit(name, args)
+        else:
+            row = await self.fetchrow(name, *args)
+
+        if row is not None:
+            self.touch_party(row['party_id'])
+        return row
+
+    # === Текущая партия пользователя ===
+    async def get_current_party(self, tg_id: int):
+        """Номер текущей партии или None; переживает перезапуск бота"""
+        # Еще не записанный выбор новее того, что в БД
+        writer = self.session_writer
+        if writer is not None and tg_id in writer.pending:
+            return writer.pending[tg_id]
+
+        batch_number = await self.session_cache.get_or_load(tg_id, lambda: self._load_current_party(tg_id))
+        return batch_number or None
+
+    async def _load_current_party(self, tg_id: int):
+        return await self.fetchval('get_last_party', tg_id) or ''
+
+    def set_current_party(self, tg_id: int, batch_number):
+        """Запомнить текущую партию; в БД попадет со следующей пачкой"""
+        self.session_cache.set(tg_id, batch_number or '')
+        if self.session_writer is not None:
+            self.session_writer.submit(tg_id, batch_number)
+
+    # === Состояния FSM ===
+    async def get_fsm(self, storage_key: str):
+        """(state, data как JSON-текст); ключа нет или состояние истекло - (None, '{}')"""
+        state, data, expires_at = await self.fsm_cache.get_or_load(
+            storage_key, lambda: self._load_fsm(storage_key)
+        )
+        if expires_at is not None and expires_at <= time.monotonic():
+            # Сценарий брошен: число, введенное сейчас, не должно попасть
+            # в материал, выбранный давно
+            self.fsm_expired_on_read += 1
+            await self._delete_fsm(storage_key)
+            return None, '{}'
+        return state, data
+
+    async def _load_fsm(self, storage_key: str):
+        row = await self.fetchrow('fsm_get', storage_key)
+        # Отсутствие записи тоже кэшируем - состояние читается на каждом апдейте
+        return self._fsm_entry(row) if row else (None, '{}', None)
+
+    @staticmethod
+    def _fsm_entry(row):
+        expires_at = time.monotonic() + row['ttl_left'] if row['ttl_left'] is not None else None
+        return row['state'], row['data'], expires_at
+
+    async def set_fsm_state(self, storage_key: str, state):
+        _, data = await self.get_fsm(storage_key)
+        if state is None and data == '{}':
+            await self._delete_fsm(storage_key)
+            return
+
+        row = await self.fetchrow('fsm_set_state', storage_key, state, get_state_ttl(state))
+        self._store_fsm(storage_key, self._fsm_entry(row))
+
+    async def set_fsm_data(self, storage_key: str, data: dict):
+        state, _ = await self.get_fsm(storage_key)
+        if state is None and not data:
+            await self._delete_fsm(storage_key)
+            return
+
+        payload = json.dumps(data, ensure_ascii=False, default=_fsm_json_default)
+        size = len(payload.encode())
+        if size > FSM_MAX_DATA_SIZE:
+            # Не ValueError: обработчики ловят его как "введите число"
+            raise FSMDataTooLarge(storage_key, size, FSM_MAX_DATA_SIZE, data)
+        row = await self.fetchrow('fsm_set_data', storage_key, payload, get_state_ttl(state))
+        self._store_fsm(storage_key, self._fsm_entry(row))
+
+    async def _delete_fsm(self, storage_key: str):
+        await self.execute('fsm_delete', storage_key)
+        self._store_fsm(storage_key, (None, '{}', None))
+
+    def _store_fsm(self, storage_key: str, entry):
+        # Запись сквозная: свой кэш обновляем, остальным экземплярам - сброс
+        self.fsm_cache.set(storage_key, entry)
+        if self.invalidation_channel is not None:
+            self.invalidation_channel.publish('fsm', storage_key)
 
     async def check_tables(self):
         """Проверка существования таблиц"""
-        if not self.pool:
-            await self.create_pool()
+        tables = await self.fetch('check_tables')
+        return [table['table_name'] for table in tables]
 
-        async with self.pool.acquire() as conn:
-            tables = await conn.fetch(
-                "SELECT table_name FROM information_schema.tables WHERE table_schema = 'public'"
-            )
-            return [table['table_name'] for table in tables]
-
-    async def create_tables_if_not_exist(self):
-        """Создание таблиц если они не существуют"""
-        if not self.pool:
-            await self.create_pool()
-
-        async with self.pool.acquire() as conn:
-            # Таблица parties с полем design
-            await conn.execute("""
-                CREATE TABLE IF NOT EXISTS parties (
-                    id SERIAL PRIMARY KEY,
-                    batch_number VARCHAR(50) UNIQUE NOT NULL,
-                    design VARCHAR(100),
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-
-            # Таблица materials
-            await conn.execute("""
-                CREATE TABLE IF NOT EXISTS materials (
-                    id SERIAL PRIMARY KEY,
-                    party_id INTEGER NOT NULL REFERENCES parties(id) ON DELETE CASCADE,
-                    color VARCHAR(100),
-                    quantity_line INTEGER,
-                    tshirt_count INTEGER,
-                    four_x VARCHAR(100),
-                    four_x_count INTEGER,
-                    raspash VARCHAR(100),
-                    raspash_count INTEGER,
-                    beika VARCHAR(100),
-                    beika_count INTEGER,
-                    strochka VARCHAR(100),
-                    strochka_count INTEGER,
-                    gorlo VARCHAR(100),
-                    gorlo_count INTEGER,
-                    ytyg VARCHAR(100),
-                    ytyg_count INTEGER,
-                    otk VARCHAR(100),
-                    otk_count INTEGER,
-                    ypakovka VARCHAR(100),
-                    ypakovka_count INTEGER,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
+    async def migrate(self):
+        """Применить версионные миграции схемы на отдельном подключении"""
+        from migrations import run_migrations
 
-            print("Таблицы созданы/проверены")
+        conn = await asyncpg.connect(DATABASE_URL)
+        try:
+            await run_migrations(conn)
+        finally:
+            await conn.close()
 
     async def add_party_with_design(self, batch_number: str, design: str):
         """Добавить партию с дизайном"""
-        if not self.pool:
-            await self.create_pool()
-
-        async with self.pool.acquire() as conn:
-            try:
-                await conn.execute(
-                    """
-                    INSERT INTO parties (batch_number, design) 
-                    VALUES ($1, $2)
-                    """,
-                    batch_number, design
-                )
-                return True
-            except asyncpg.UniqueViolationError:
-                return False
-            except Exception as e:
-                print(f"Ошибка при добавлении партии: {e}")
-                return False
-
-    async def get_user_by_name(self, name: str):
-        """Получить пользователя по имени"""
-        if not self.pool:
-            await self.create_pool()
-
-        async with self.pool.acquire() as conn:
-            return await conn.fetchrow(
-                "SELECT * FROM users WHERE name ILIKE $1",
-                f"%{name}%"
-            )
+        try:
+            party_id = await self.fetchval('add_party', batch_number, design)
+            self.invalidate_parties()
+            self.touch_party(party_id)
+            return True
+        except asyncpg.UniqueViolationError:
+            return False
+        except Exception as e:
+            print(f"Ошибка при добавлении партии: {e}")
+            return False
 
-db = Database()
+db = Database()
\ No newline at end of file
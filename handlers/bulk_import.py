@@ -0,0 +1,73 @@
+import io
+
+import asyncpg
+from aiogram import types
+from aiogram.fsm.context import FSMContext
+
+from db import db
+from importer import parse_materials_csv, decode_csv, MAX_REPORTED_ERRORS
+from keyboards import get_cancel_keyboard
+from roles import Role
+from states import ImportStates
+
+
+async def import_command(message: types.Message, state: FSMContext, user):
+    """Массовый импорт материалов из CSV - только для закройщика"""
+    if not user or user['role'] is not Role.ZAKROI:
+        await message.answer("Импорт доступен только закройщику")
+        return
+
+    await state.set_state(ImportStates.waiting_for_file)
+    await message.answer(
+        "📥 Импорт раскроя из CSV\n\n"
+        "Отправьте файл с колонками:\n"
+        "партия; дизайн; цвет; линий; футболок (необязательно)\n\n"
+        "Если футболки не указаны, считаются как линий × 5.",
+        reply_markup=get_cancel_keyboard()
+    )
+
+
+async def import_file_handler(message: types.Message, state: FSMContext):
+    """Обработка загруженного CSV"""
+    if not message.document:
+        await message.answer("Пришлите CSV-файл документом или нажмите «Отмена»")
+        return
+
+    buffer = io.BytesIO()
+    await message.bot.download(message.document, destination=buffer)
+
+    try:
+        text = decode_csv(buffer.getvalue())
+    except UnicodeDecodeError:
+        await message.answer("Не удалось прочитать файл. Сохраните его как CSV (UTF-8).")
+        return
+
+    rows, errors = parse_materials_csv(text)
+
+    if errors:
+        shown = "\n".join(errors[:MAX_REPORTED_ERRORS])
+        more = f"\n... и еще {len(errors) - MAX_REPORTED_ERRORS}" if len(errors) > MAX_REPORTED_ERRORS else ""
+        await message.answer(
+            f"❌ Файл не импортирован, ошибок: {len(errors)}\n\n{shown}{more}\n\n"
+            "Исправьте файл и отправьте снова."
+        )
+        return
+
+    try:
+        parties_created, materials_added = await db.import_materials(rows)
+    except asyncpg.PostgresError as e:
+        # Текст ошибки БД пользователю не показываем - только в лог
+        print(f"❌ Ошибка импорта: {e}")
+        await message.answer(
+            "❌ База данных не приняла файл, ничего не импортировано.\n"
+            "Проверьте данные и попробуйте еще раз."
+        )
+        await state.clear()
+        return
+
+    await state.clear()
+    await message.answer(
+        f"✅ Импорт завершен!\n"
+        f"Новых партий: {parties_created}\n"
+        f"Материалов добавлено: {materials_added}"
+    )
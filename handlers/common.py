@@ -3,9 +3,10 @@ from aiogram import types
 from aiogram.fsm.context import FSMContext
 
 
-from db import db
-from keyboards import get_main_menu_keyboard, get_parties_keyboard, get_cancel_keyboard
-from service import user_service,user_sessions,party_service
+from db import db, JOB_STAGES
+from keyboards import get_main_menu_keyboard, get_cancel_keyboard
+from roles import Role
+from service import user_service, party_service, keyboard_service
 import handlers.zakroi as zakroi_handlers
 import handlers.fourx as fourx_handlers
 import handlers.raspash as raspash_handlers
@@ -20,15 +21,26 @@ from states import ZakroiStates
 import handlers.party_management as party_management_handlers
 
 
+# Продолжение работы в той же партии по роли оператора
+CONTINUE_WORK_HANDLERS = {
+    Role.FOUR_X: fourx_handlers.fourx_continue_work,
+    Role.RASPASH: raspash_handlers.raspash_continue_work,
+    Role.BEIKA: beika_handlers.beika_continue_work,
+    Role.STROCHKA: strochka_handlers.strochka_continue_work,
+    Role.GORLO: gorlo_handlers.gorlo_continue_work,
+    Role.YTYG: ytyg_handlers.ytyg_continue_work,
+    Role.OTK: otk_handlers.otk_continue_work,
+    Role.UPAKOVKA: upakovka_handlers.upakovka_continue_work,
+}
+
+
 # ========== ОБЩИЕ КОМАНДЫ ==========
-async def start_handler(message: types.Message, state: FSMContext):
+async def start_handler(message: types.Message, state: FSMContext, user):
     from config import ZAKROISHCHIK_ID
 
     # Сначала проверяем, является ли пользователь закройщиком по ID
     if message.from_user.id == ZAKROISHCHIK_ID:
-        # Проверяем, есть ли закройщик в базе
-        user = await db.get_user(ZAKROISHCHIK_ID)
-
+        # Закройщика может еще не быть в базе
         if not user:
             # Если закройщика нет в базе, регистрируем его
             await db.add_user(
@@ -49,15 +61,10 @@ async def start_handler(message: types.Message, state: FSMContext):
             reply_markup=get_main_menu_keyboard(user['job'])
         )
 
-        if 'current_party' not in user_sessions.get(message.from_user.id, {}):
-            user_sessions[message.from_user.id] = {'current_party': None}
-
         await state.clear()
         return
 
     # Для обычных пользователей - стандартная логика
-    user = await db.get_user(message.from_user.id)
-
     if user:
         print(f"👤 Пользователь {user['name']} (должность в БД: '{user['job']}') запустил бота")
 
@@ -66,9 +73,6 @@ async def start_handler(message: types.Message, state: FSMContext):
             reply_markup=get_main_menu_keyboard(user['job'])
         )
 
-        if 'current_party' not in user_sessions.get(message.from_user.id, {}):
-            user_sessions[message.from_user.id] = {'current_party': None}
-
     else:
         from states import RegistrationStates
         await state.set_state(RegistrationStates.waiting_for_name)
@@ -77,9 +81,8 @@ async def start_handler(message: types.Message, state: FSMContext):
             "Пожалуйста, представьтесь - напишите ваше имя:"
         )
 
-async def show_parties_command(message: types.Message):
+async def show_parties_command(message: types.Message, user):
     """Показать все партии"""
-    user = await db.get_user(message.from_user.id)
     user_job = user['job'] if user else None
 
     parties = await db.get_all_parties()
@@ -87,8 +90,7 @@ async def show_parties_command(message: types.Message):
         await message.answer("Пока нет ни одной партии")
         return
 
-    from keyboards import get_parties_keyboard
-    keyboard = get_parties_keyboard(parties, user_job, with_management=False)
+    keyboard = await keyboard_service.get_parties_keyboard(user_job, with_management=False)
 
     await message.answer("Выберите партию:", reply_markup=keyboard)
 
@@ -99,9 +101,8 @@ async def cancel_handler(message: types.Message, state: FSMContext):
     await message.answer("Действие отменено", reply_markup=types.ReplyKeyboardRemove())
 
 
-async def me_command(message: types.Message):
+async def me_command(message: types.Message, user):
     """Информация о пользователе"""
-    user = await db.get_user(message.from_user.id)
     if user:
         machine_info = f"Машинка: {user['machine_number']}\n" if user['machine_number'] else ""
         await message.answer(
@@ -121,14 +122,13 @@ async def reset_command(message: types.Message, state: FSMContext):
     await message.answer("Состояние сброшено. Используйте /start для регистрации.")
 
 
-async def info_command(message: types.Message):
+async def info_command(message: types.Message, user):
     """Показать информацию о текущей партии"""
-    user = await db.get_user(message.from_user.id)
     if not user:
         await message.answer("Сначала пройдите регистрацию через /start")
         return
 
-    current_party = user_sessions.get(message.from_user.id, {}).get('current_party')
+    current_party = await user_service.get_current_party(message.from_user.id)
     if not current_party:
         await message.answer("У вас не выбрана текущая партия. Используйте 'Сменить партию'")
         return
@@ -142,7 +142,7 @@ async def info_command(message: types.Message):
     await message.answer(f"📦 Текущая партия: №{current_party}\n\n{info}")
 
 
-async def party_selected_from_menu(call: types.CallbackQuery):
+async def party_selected_from_menu(call: types.CallbackQuery, user):
     """Обработка выбора партии из меню"""
     if not call.data.startswith("party_"):
         return
@@ -155,16 +155,13 @@ async def party_selected_from_menu(call: types.CallbackQuery):
         await call.answer()
         return
 
-    user = await db.get_user(call.from_user.id)
     user_job = user['job'] if user else None
 
     # Сохраняем выбранную партию
-    if call.from_user.id not in user_sessions:
-        user_sessions[call.from_user.id] = {}
-    user_sessions[call.from_user.id]['current_party'] = batch_number
+    user_service.set_current_party(call.from_user.id, batch_number)
 
     # Разный текст для закройщика и оператора
-    if user_service.is_zakroi_sync(user_job):
+    if user and user['role'] is Role.ZAKROI:
         # Для закройщика - детальная информация
         info = await party_service.format_party_info_detailed(party['id'], user_job)
         await call.message.answer(
@@ -191,10 +188,9 @@ async def cancel_callback(call: types.CallbackQuery, state: FSMContext):
 
 # ========== ОБРАБОТКА КНОПОК ГЛАВНОГО МЕНЮ ==========
 
-async def new_record_handler(message: types.Message, state: FSMContext):
+async def new_record_handler(message: types.Message, state: FSMContext, user):
     """Обработка кнопки 'Новая запись' для закройщика"""
-    user = await db.get_user(message.from_user.id)
-    if user and user_service.is_zakroi_sync(user['job']):
+    if user and user['role'] is Role.ZAKROI:
         # Проверяем есть ли партии
         parties = await db.get_all_parties()
 
@@ -208,14 +204,13 @@ async def new_record_handler(message: types.Message, state: FSMContext):
             )
         else:
             # Если партии есть, показываем список для выбора
-            await zakroi_handlers.zakroi_start_menu(message, state)
+            await zakroi_handlers.zakroi_start_menu(message, state, user)
     else:
         await message.answer("Эта функция доступна только закройщикам")
 
 
-async def start_work_handler(message: types.Message, state: FSMContext):
+async def start_work_handler(message: types.Message, state: FSMContext, user):
     """Обработка кнопки 'Начать работу'"""
-    user = await db.get_user(message.from_user.id)
     if not user:
         await message.answer("Сначала пройдите регистрацию через /start")
         return
@@ -223,101 +218,22 @@ async def start_work_handler(message: types.Message, state: FSMContext):
     job = user['job']
     print(f"🚀 Начало работы для {user['name']} ({job})")
 
-    if job == '4-х':
+    if user['role'] in JOB_STAGES:
         # Показываем список партий для выбора
         parties = await db.get_all_parties()
         if not parties:
             await message.answer("Нет доступных партий")
             return
 
-        from keyboards import get_parties_keyboard
-        keyboard = get_parties_keyboard(parties, user['job'], with_management=False)
-        await message.answer("Выберите партию для работы:", reply_markup=keyboard)
-
-    elif job == 'Распаш':
-        # Показываем список партий для распаш
-        parties = await db.get_all_parties()
-        if not parties:
-            await message.answer("Нет доступных партий")
-            return
-
-        from keyboards import get_parties_keyboard
-        keyboard = get_parties_keyboard(parties, user['job'], with_management=False)
-        await message.answer("Выберите партию для работы:", reply_markup=keyboard)
-
-    elif job == 'Бейка':
-        # Показываем список партий для бейки
-        parties = await db.get_all_parties()
-        if not parties:
-            await message.answer("Нет доступных партий")
-            return
-
-        from keyboards import get_parties_keyboard
-        keyboard = get_parties_keyboard(parties, user['job'], with_management=False)
-        await message.answer("Выберите партию для работы:", reply_markup=keyboard)
-
-    elif job == 'Строчка':
-        # Показываем список партий для строчки
-        parties = await db.get_all_parties()
-        if not parties:
-            await message.answer("Нет доступных партий")
-            return
-
-        from keyboards import get_parties_keyboard
-        keyboard = get_parties_keyboard(parties, user['job'], with_management=False)
-        await message.answer("Выберите партию для работы:", reply_markup=keyboard)
-
-    elif job == 'Горло':
-        # Показываем список партий для горла
-        parties = await db.get_all_parties()
-        if not parties:
-            await message.answer("Нет доступных партий")
-            return
-
-        from keyboards import get_parties_keyboard
-        keyboard = get_parties_keyboard(parties, user['job'], with_management=False)
-        await message.answer("Выберите партию для работы:", reply_markup=keyboard)
-
-    elif job == 'Утюг':
-        # Показываем список партий для утюга
-        parties = await db.get_all_parties()
-        if not parties:
-            await message.answer("Нет доступных партий")
-            return
-
-        from keyboards import get_parties_keyboard
-        keyboard = get_parties_keyboard(parties, user['job'], with_management=False)
-        await message.answer("Выберите партию для работы:", reply_markup=keyboard)
-
-    elif job == 'OTK':
-        # Показываем список партий для ОТК
-        parties = await db.get_all_parties()
-        if not parties:
-            await message.answer("Нет доступных партий")
-            return
-
-        from keyboards import get_parties_keyboard
-        keyboard = get_parties_keyboard(parties, user['job'], with_management=False)
-        await message.answer("Выберите партию для работы:", reply_markup=keyboard)
-
-    elif job == 'Упаковка':
-        # Показываем список партий для упаковки
-        parties = await db.get_all_parties()
-        if not parties:
-            await message.answer("Нет доступных партий")
-            return
-
-        from keyboards import get_parties_keyboard
-        keyboard = get_parties_keyboard(parties, user['job'], with_management=False)
+        keyboard = await keyboard_service.get_parties_keyboard(user['job'], with_management=False)
         await message.answer("Выберите партию для работы:", reply_markup=keyboard)
 
     else:
         await message.answer(f"Для должности '{job}' нет активных действий")
 
 
-async def change_party_handler(message: types.Message):
+async def change_party_handler(message: types.Message, user):
     """Обработка кнопки 'Сменить партию'"""
-    user = await db.get_user(message.from_user.id)
     if not user:
         await message.answer("Сначала пройдите регистрацию через /start")
         return
@@ -327,50 +243,31 @@ async def change_party_handler(message: types.Message):
         await message.answer("Нет доступных партий")
         return
 
-    # Для обычных пользователей - without management
-    # Для закройщика - с кнопкой управления
-    is_zakroi = user['job'] == 'Закрой'
-    keyboard = get_parties_keyboard(parties, user['job'], with_management=False and not is_zakroi)
+    keyboard = await keyboard_service.get_parties_keyboard(user['job'], with_management=False)
     await message.answer("Выберите партию для работы:", reply_markup=keyboard)
 
 
-async def my_stats_handler(message: types.Message):
+async def my_stats_handler(message: types.Message, user):
     """Обработка кнопки 'Мои данные'"""
-    user = await db.get_user(message.from_user.id)
     if not user:
         await message.answer("Сначала пройдите регистрацию через /start")
         return
 
-    current_party = user_sessions.get(message.from_user.id, {}).get('current_party', 'не выбрана')
+    current_party = await user_service.get_current_party(message.from_user.id) or 'не выбрана'
 
     # Получаем статистику по работам пользователя
-    async with db.pool.acquire() as conn:
-        # Для каждой должности своя статистика
-        if user['job'] == 'Закрой':
-            materials_count = await conn.fetchval(
-                "SELECT COUNT(*) FROM materials WHERE party_id IN (SELECT id FROM parties)"
-            )
-            stats_text = f"Создано материалов: {materials_count or 0}"
+    if user['role'] is Role.ZAKROI:
+        materials_count = await db.get_materials_count()
+        stats_text = f"Создано материалов: {materials_count or 0}"
+    else:
+        # Для остальных должностей - сумма по журналу работ
+        stage = JOB_STAGES.get(user['role'])
+
+        if stage:
+            total_count = await db.get_user_stage_total(user['id'], stage)
+            stats_text = f"Выполнено работ: {total_count or 0} шт"
         else:
-            # Для остальных должностей
-            job_column = {
-                '4-х': 'four_x_count',
-                'Распаш': 'raspash_count',
-                'Бейка': 'beika_count',
-                'Строчка': 'strochka_count',
-                'Горло': 'gorlo_count',
-                'Утюг': 'ytyg_count',
-                'OTK': 'otk_count',
-                'Упаковка': 'ypakovka_count'
-            }.get(user['job'])
-
-            if job_column:
-                total_count = await conn.fetchval(
-                    f"SELECT SUM({job_column}) FROM materials WHERE {job_column} IS NOT NULL"
-                )
-                stats_text = f"Выполнено работ: {total_count or 0} шт"
-            else:
-                stats_text = "Статистика не доступна"
+            stats_text = "Статистика не доступна"
 
     await message.answer(
         f"📊 Ваша статистика:\n"
@@ -382,14 +279,13 @@ async def my_stats_handler(message: types.Message):
     )
 
 
-async def all_parties_handler(message: types.Message):
+async def all_parties_handler(message: types.Message, user):
     """Обработка кнопки 'Все партии'"""
-    await show_parties_command(message)
+    await show_parties_command(message, user)
 
 
-async def handle_unknown(message: types.Message):
+async def handle_unknown(message: types.Message, user):
     """Обработка неизвестных сообщений"""
-    user = await db.get_user(message.from_user.id)
     if user:
         await message.answer(
             "Неизвестная команда. Используйте кнопки меню или команды:\n"
@@ -404,14 +300,13 @@ async def handle_unknown(message: types.Message):
         await message.answer("Сначала пройдите регистрацию через /start")
 
 
-async def change_machine_command(message: types.Message, state: FSMContext):
+async def change_machine_command(message: types.Message, state: FSMContext, user):
     """Сменить номер машинки"""
-    user = await db.get_user(message.from_user.id)
     if not user:
         await message.answer("Сначала пройдите регистрацию через /start")
         return
 
-    if user['job'] != '4-х':
+    if user['role'] is not Role.FOUR_X:
         await message.answer("Эта команда доступна только 4-х операторам")
         return
 
@@ -422,19 +317,18 @@ async def change_machine_command(message: types.Message, state: FSMContext):
         reply_markup=get_cancel_keyboard()
     )
 
-async def manage_users_handler(message: types.Message, state: FSMContext):
+async def manage_users_handler(message: types.Message, state: FSMContext, user):
     """Обработка кнопки 'Управление пользователями'"""
-    await user_management_handlers.user_management_menu(message, state)
+    await user_management_handlers.user_management_menu(message, state, user)
 
-async def manage_users_command(message: types.Message, state: FSMContext):
+async def manage_users_command(message: types.Message, state: FSMContext, user):
     """Команда для управления пользователями"""
-    await user_management_handlers.user_management_start(message, state)
+    await user_management_handlers.user_management_start(message, state, user)
 
 
-async def new_party_callback(call: types.CallbackQuery, state: FSMContext):
+async def new_party_callback(call: types.CallbackQuery, state: FSMContext, user):
     """Создание новой партии из меню"""
-    user = await db.get_user(call.from_user.id)
-    if not user or user['job'] != 'Закрой':
+    if not user or user['role'] is not Role.ZAKROI:
         await call.message.answer("Только закройщик может создавать новые партии")
         await call.answer()
         return
@@ -447,12 +341,10 @@ async def new_party_callback(call: types.CallbackQuery, state: FSMContext):
     await call.answer()
 
 
-async def manage_parties_handler(message: types.Message, state: FSMContext):
+async def manage_parties_handler(message: types.Message, state: FSMContext, user):
     """Обработка кнопки 'Управление партиями'"""
     print(f"🔍 Кнопка 'Управление партиями' нажата пользователем {message.from_user.id}")
 
-    user = await db.get_user(message.from_user.id)
-
     if not user:
         print(f"❌ Пользователь не найден в БД")
         await message.answer("Сначала пройдите регистрацию через /start")
@@ -462,22 +354,21 @@ async def manage_parties_handler(message: types.Message, state: FSMContext):
 
     # Временно отключаем проверку чтобы увидеть что происходит
     print(f"🔄 Переходим к управлению партиями...")
-    await party_management_handlers.party_management_start(message, state)
+    await party_management_handlers.party_management_start(message, state, user)
 
 
-async def check_my_data(message: types.Message):
+async def check_my_data(message: types.Message, user):
     """Проверить мои данные в БД"""
-    user = await db.get_user(message.from_user.id)
-
     if not user:
         await message.answer("Вы не зарегистрированы в БД")
         return
 
     # Проверяем все поля
-    from keyboards import is_zakroi_sync, normalize_job_sync
+    from roles import is_zakroi_sync, normalize_job_sync
 
     normalized_job = normalize_job_sync(user['job'])
     is_zakroi = is_zakroi_sync(user['job'])
+    role = user['role'].value if user['role'] else '—'
 
     response = (
         f"📊 Ваши данные в БД:\n\n"
@@ -490,6 +381,7 @@ async def check_my_data(message: types.Message):
         f"Проверки:\n"
         f"Нормализованная должность: '{normalized_job}'\n"
         f"is_zakroi_sync: {is_zakroi}\n"
+        f"Роль: {role}\n"
         f"user['job'] == 'Закрой': {user['job'] == 'Закрой'}\n"
         f"user['job'].lower() == 'закрой': {user['job'].lower() == 'закрой'}\n"
         f"user['job'] in ['Закрой', 'zakroi']: {user['job'] in ['Закрой', 'zakroi']}"
@@ -499,9 +391,8 @@ async def check_my_data(message: types.Message):
 
 
 
-async def back_to_parties(call: types.CallbackQuery):
+async def back_to_parties(call: types.CallbackQuery, user):
     """Возврат к списку партий"""
-    user = await db.get_user(call.from_user.id)
     user_job = user['job'] if user else None
 
     parties = await db.get_all_parties()
@@ -510,8 +401,7 @@ async def back_to_parties(call: types.CallbackQuery):
         await call.answer()
         return
 
-    from keyboards import get_parties_keyboard
-    keyboard = get_parties_keyboard(parties, user_job, with_management=False)
+    keyboard = await keyboard_service.get_parties_keyboard(user_job, with_management=False)
 
     await call.message.edit_text(
         "Выберите партию:",
@@ -520,7 +410,7 @@ async def back_to_parties(call: types.CallbackQuery):
     await call.answer()
 
 
-async def add_material_callback(call: types.CallbackQuery, state: FSMContext):
+async def add_material_callback(call: types.CallbackQuery, state: FSMContext, user):
     """Добавление материала к партии"""
     # Получаем ID партии из callback_data: add_material_{party_id}
     party_id = int(call.data.split("_")[2])
@@ -533,8 +423,7 @@ async def add_material_callback(call: types.CallbackQuery, state: FSMContext):
         return
 
     # Проверяем права (только закройщик)
-    user = await db.get_user(call.from_user.id)
-    if not user or not user_service.is_zakroi_sync(user['job']):
+    if not user or user['role'] is not Role.ZAKROI:
         await call.message.answer("Только закройщик может добавлять материалы")
         await call.answer()
         return
@@ -556,43 +445,27 @@ async def add_material_callback(call: types.CallbackQuery, state: FSMContext):
     await call.answer()
 
 
-async def continue_work_callback(call: types.CallbackQuery, state: FSMContext):
+async def continue_work_callback(call: types.CallbackQuery, state: FSMContext, user):
     """Продолжить работу в той же партии"""
     party_id = int(call.data.split("_")[2])
 
-    user = await db.get_user(call.from_user.id)
     if not user:
         await call.message.answer("Ошибка: пользователь не найден")
         await call.answer()
         return
 
-    # Определяем должность и запускаем соответствующую работу
-    job = user['job']
+    # Запускаем работу по роли пользователя
+    continue_work = CONTINUE_WORK_HANDLERS.get(user['role'])
 
-    if job == '4-х':
-        await fourx_handlers.fourx_continue_work(call, state, party_id)
-    elif job == 'Распаш':
-        await raspash_handlers.raspash_continue_work(call, state, party_id)
-    elif job == 'Бейка':
-        await beika_handlers.beika_continue_work(call, state, party_id)
-    elif job == 'Строчка':
-        await strochka_handlers.strochka_continue_work(call, state, party_id)
-    elif job == 'Горло':
-        await gorlo_handlers.gorlo_continue_work(call, state, party_id)
-    elif job == 'Утюг':
-        await ytyg_handlers.ytyg_continue_work(call, state, party_id)
-    elif job == 'OTK':
-        await otk_handlers.otk_continue_work(call, state, party_id)
-    elif job == 'Упаковка':
-        await upakovka_handlers.upakovka_continue_work(call, state, party_id)
+    if continue_work:
+        await continue_work(call, state, party_id)
     else:
-        await call.message.answer(f"Для должности '{job}' нет активных действий")
+        await call.message.answer(f"Для должности '{user['job']}' нет активных действий")
         await call.answer()
 
 
-async def change_party_callback(call: types.CallbackQuery, state: FSMContext):
+async def change_party_callback(call: types.CallbackQuery, state: FSMContext, user):
     """Сменить партию"""
-    user = await db.get_user(call.from_user.id)
     if not user:
         await call.message.answer("Сначала пройдите регистрацию")
         await call.answer()
@@ -604,8 +477,7 @@ async def change_party_callback(call: types.CallbackQuery, state: FSMContext):
         await call.answer()
         return
 
-    from keyboards import get_parties_keyboard
-    keyboard = get_parties_keyboard(parties, user['job'], with_management=False)
+    keyboard = await keyboard_service.get_parties_keyboard(user['job'], with_management=False)
 
     await call.message.edit_text(
         "Выберите партию для работы:",
@@ -614,34 +486,22 @@ async def change_party_callback(call: types.CallbackQuery, state: FSMContext):
     await call.answer()
 
 
-async def edit_operations_handler(message: types.Message, state: FSMContext):
+async def edit_operations_handler(message: types.Message, state: FSMContext, user):
     """Обработка кнопки 'Изменить показания'"""
     # Импортируем новую функцию
     from handlers.edit_operations import edit_operations_start as edit_start_fixed
-    await edit_start_fixed(message, state)
+    await edit_start_fixed(message, state, user)
 
 
-async def check_db_data(message: types.Message):
+async def check_db_data(message: types.Message, user):
     """Проверка данных в БД"""
-    user = await db.get_user(message.from_user.id)
     if not user:
         await message.answer("Вы не зарегистрированы")
         return
 
     # Получаем ВСЕ материалы где есть записи этого пользователя
-    async with db.pool.acquire() as conn:
-        # Для 4-х оператора
-        if user['job'] == '4-х':
-            materials = await conn.fetch(
-                "SELECT * FROM materials WHERE four_x ILIKE $1 AND four_x_count > 0",
-                f"%{user['name']}%"
-            )
-        elif user['job'] == 'Распаш':
-            materials = await conn.fetch(
-                "SELECT * FROM materials WHERE raspash ILIKE $1 AND raspash_count > 0",
-                f"%{user['name']}%"
-            )
-        # ... и так далее для других должностей
+    stage = JOB_STAGES.get(user['role'])
+    materials = await db.get_materials_by_worker(stage, user['id']) if stage else []
 
     if not materials:
         await message.answer(f"В БД нет записей для {user['name']} ({user['job']})")
@@ -650,8 +510,103 @@ async def check_db_data(message: types.Message):
     response = f"📊 Найденные записи для {user['name']} ({user['job']}):\n\n"
     for material in materials:
         response += f"Партия ID: {material['party_id']}, Цвет: {material['color']}\n"
-        if user['job'] == '4-х':
+        if user['role'] is Role.FOUR_X:
             response += f"  four_x: '{material['four_x']}', count: {material['four_x_count']}\n"
         response += "\n"
 
     await message.answer(response)
+
+
+async def cache_stats_command(message: types.Message, user, dispatcher=None):
+    """Статистика кэшей и пула подключений (только для закройщика)"""
+    if not user or user['role'] is not Role.ZAKROI:
+        await message.answer("Эта функция доступна только закройщикам")
+        return
+
+    from cache import CACHES
+
+    response = "📈 Кэши:\n\n"
+    for name, cache in sorted(CACHES.items()):
+        stats = cache.stats()
+        lookups = stats['hits'] + stats['misses']
+        hit_rate = f"{stats['hits'] * 100 / lookups:.0f}%" if lookups else "—"
+        response += (
+            f"{name}: {stats['size']}/{stats['maxsize']}, TTL {stats['ttl']:g}с\n"
+            f"  попадания: {stats['hits']}, промахи: {stats['misses']} ({hit_rate})\n"
+            f"  вытеснено: {stats['evictions']}, сбросов: {stats['invalidations']}\n"
+        )
+
+    statements = db.get_statement_stats()
+    if statements:
+        hits = sum(stats['hits'] for stats in statements.values())
+        misses = sum(stats['misses'] for stats in statements.values())
+        response += f"\n🧾 Подготовленные выражения: повторно {hits}, подготовлено заново {misses}\n"
+        # Выражения, которые чаще всего готовились заново
+        for name, stats in sorted(statements.items(), key=lambda item: -item[1]['misses'])[:5]:
+            if stats['misses']:
+                response += f"  {name}: {stats['hits']}/{stats['misses']}\n"
+
+    db_stats = db.pool_stats()
+    pool = db_stats.get('pool')
+    if pool:
+        response += (
+            f"\n🗄️ Пул: {pool['size']} подключений, свободно {pool['idle']} "
+            f"(min {pool['min_size']}, max {pool['max_size']})\n"
+        )
+    if 'write_queue' in db_stats:
+        queue = db_stats['write_queue']
+        response += f"✍️ Очередь записи: {queue['batches']} пачек, {queue['items']} записей\n"
+    if 'sessions' in db_stats:
+        sessions = db_stats['sessions']
+        response += f"📌 Текущие партии: {sessions['batches']} пачек, {sessions['items']} записей\n"
+    if 'fsm' in db_stats:
+        fsm = db_stats['fsm']
+        response += (
+            f"🧹 Брошенные сценарии: очисткой {fsm['reclaimed']} (проходов {fsm['sweeps']}), "
+            f"истекли при чтении {fsm['expired_on_read']}\n"
+        )
+    if 'notify' in db_stats:
+        notify = db_stats['notify']
+        response += f"📡 Сбросы кэшей: отправлено {notify['sent']}, получено {notify['received']}\n"
+
+    isolation = dispatcher.fsm.events_isolation if dispatcher else None
+    if hasattr(isolation, 'stats'):
+        queue = isolation.stats()
+        response += (
+            f"⏳ Очереди пользователей: активных {queue['active']}, апдейтов {queue['acquired']}, "
+            f"ждали {queue['waited']} (в среднем {queue['avg_wait'] * 1000:.0f}мс, "
+            f"максимум {queue['max_wait'] * 1000:.0f}мс), отклонено {queue['rejected']}\n"
+        )
+
+    await message.answer(response)
+
+
+async def fsm_data_too_large_handler(event: types.ErrorEvent):
+    """Данные сценария не поместились в хранилище - просим текст покороче.
+
+    Состояние не изменилось, поэтому пользователь может сразу отправить снова.
+    """
+    print(f"⚠️ {event.exception}")
+
+    text = "Слишком длинный текст. Отправьте покороче или нажмите «Отмена»"
+    try:
+        if event.update.message:
+            await event.update.message.answer(text)
+        elif event.update.callback_query:
+            await event.update.callback_query.answer(text, show_alert=True)
+    except Exception:
+        pass
+    return True
+
+
+async def user_queue_full_handler(event: types.ErrorEvent):
+    """Лишние апдейты пользователя (очередь переполнена) отбрасываются молча"""
+    print(f"⚠️ {event.exception}")
+
+    call = event.update.callback_query
+    if call:
+        try:
+            await call.answer("Подождите, предыдущее действие еще выполняется")
+        except Exception:
+            pass
+    return True
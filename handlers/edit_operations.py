@@ -2,77 +2,37 @@ from aiogram import types
 from aiogram.fsm.context import FSMContext
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
-from db import db
-from service import user_service
+from config import COUNT_SUBMISSION_MODE
+from db import db, JOB_STAGES, STAGE_COLUMNS, STAGE_TITLES
+from roles import Role
 from states import EditOperationsStates
 
 
-async def edit_operations_start(message: types.Message, state: FSMContext):
+async def edit_operations_start(message: types.Message, state: FSMContext, user):
     """Начало изменения показаний КОЛИЧЕСТВА футболок"""
-    user = await db.get_user(message.from_user.id)
     if not user:
         await message.answer("Сначала пройдите регистрацию через /start")
         return
 
     # Только операторы (не закройщики) могут менять свои показания
-    if user_service.is_zakroi_sync(user['job']):
+    if user['role'] is Role.ZAKROI:
         await message.answer("Закройщики не могут менять свои показания через эту функцию")
         return
 
     await state.set_state(EditOperationsStates.waiting_for_party_selection)
 
-    # Получаем ВСЕ партии и проверяем каждую
-    all_parties = await db.get_all_parties()
-    parties_with_work = []
-
-    print(f"🔍 Поиск работ для {user['name']} ({user['job']})")
-    print(f"🔍 Всего партий: {len(all_parties)}")
-
-    for party in all_parties:
-        materials = await db.get_materials_by_party(party['id'])
-        print(f"🔍 Партия {party['batch_number']}: материалов {len(materials)}")
-
-        for material in materials:
-            # Проверяем, есть ли записи этого пользователя
-            user_name = user['name'].strip().lower()
-            found = False
-
-            # Проверяем ВСЕ поля для этого пользователя
-            if user['job'] == '4-х':
-                if material['four_x'] and material['four_x'].strip().lower() == user_name:
-                    print(f"   ✅ Нашел запись 4-х в материале {material['id']}: {material['four_x_count']}шт")
-                    found = True
-            elif user['job'] == 'Распаш':
-                if material['raspash'] and material['raspash'].strip().lower() == user_name:
-                    print(f"   ✅ Нашел запись Распаш в материале {material['id']}: {material['raspash_count']}шт")
-                    found = True
-            elif user['job'] == 'Бейка':
-                if material['beika'] and material['beika'].strip().lower() == user_name:
-                    print(f"   ✅ Нашел запись Бейка в материале {material['id']}: {material['beika_count']}шт")
-                    found = True
-            elif user['job'] == 'Строчка':
-                if material['strochka'] and material['strochka'].strip().lower() == user_name:
-                    print(f"   ✅ Нашел запись Строчка в материале {material['id']}: {material['strochka_count']}шт")
-                    found = True
-            elif user['job'] == 'Горло':
-                if material['gorlo'] and material['gorlo'].strip().lower() == user_name:
-                    found = True
-            elif user['job'] == 'Утюг':
-                if material['ytyg'] and material['ytyg'].strip().lower() == user_name:
-                    found = True
-            elif user['job'] == 'OTK':
-                if material['otk'] and material['otk'].strip().lower() == user_name:
-                    found = True
-            elif user['job'] == 'Упаковка':
-                if material['ypakovka'] and material['ypakovka'].strip().lower() == user_name:
-                    found = True
-
-            if found:
-                if party not in parties_with_work:
-                    parties_with_work.append(party)
-                break  # Достаточно одной записи в партии
-
-    print(f"✅ Всего найдено партий с работами: {len(parties_with_work)}")
+    # Партии, где есть записи этого пользователя - по ссылке на users.id.
+    # В режиме increment исполнитель в materials - только последний
+    # отправивший, поэтому свои записи ищем по журналу работ
+    stage = JOB_STAGES.get(user['role'])
+    if not stage:
+        parties_with_work = []
+    elif COUNT_SUBMISSION_MODE == 'increment':
+        parties_with_work = await db.get_parties_by_journal(stage, user['id'])
+    else:
+        parties_with_work = await db.get_parties_by_worker(stage, user['id'])
+
+    print(f"✅ Найдено партий с работами для {user['name']} ({user['job']}): {len(parties_with_work)}")
 
     if not parties_with_work:
         await message.answer("У вас нет записанных работ для изменения.")
@@ -95,7 +55,7 @@ async def edit_operations_start(message: types.Message, state: FSMContext):
     )
 
 
-async def edit_party_selected(call: types.CallbackQuery, state: FSMContext):
+async def edit_party_selected(call: types.CallbackQuery, state: FSMContext, user):
     """Выбор партии для редактирования КОЛИЧЕСТВА"""
     batch_number = call.data.split("_")[1]
     party = await db.get_party_by_number(batch_number)
@@ -105,120 +65,44 @@ async def edit_party_selected(call: types.CallbackQuery, state: FSMContext):
         await call.answer()
         return
 
-    user = await db.get_user(call.from_user.id)
-    user_name = user['name'].strip().lower()
+    stage = JOB_STAGES.get(user['role'])
 
-    print(f"🔍 Поиск работ в партии {batch_number} для {user['name']} ({user['job']})")
+    # Материалы партии с показаниями пользователя на его этапе
+    if not stage:
+        materials = []
+    elif COUNT_SUBMISSION_MODE == 'increment':
+        materials = await db.get_party_materials_by_journal(party['id'], stage, user['id'])
+    else:
+        materials = await db.get_party_materials_by_worker(stage, party['id'], user['id'])
 
-    # Получаем все материалы в партии
-    materials = await db.get_materials_by_party(party['id'])
-    user_materials = []
+    print(f"✅ Найдено записей в партии {batch_number} для {user['name']}: {len(materials)}")
 
-    for material in materials:
-        print(f"🔍 Материал {material['id']} - цвет: {material['color']}")
-
-        # Проверяем по всем полям для этой должности
-        current_count = None
-        operation_field = None
-        found = False
-
-        if user['job'] == '4-х':
-            if material['four_x'] and material['four_x'].strip().lower() == user_name:
-                current_count = material['four_x_count']
-                operation_field = 'four_x_count'
-                found = True
-                print(
-                    f"   ✅ four_x: '{material['four_x']}' == '{user_name}'? {material['four_x'].strip().lower() == user_name}")
-                print(f"   ✅ Количество: {current_count}")
-        elif user['job'] == 'Распаш':
-            if material['raspash'] and material['raspash'].strip().lower() == user_name:
-                current_count = material['raspash_count']
-                operation_field = 'raspash_count'
-                found = True
-        elif user['job'] == 'Бейка':
-            if material['beika'] and material['beika'].strip().lower() == user_name:
-                current_count = material['beika_count']
-                operation_field = 'beika_count'
-                found = True
-        elif user['job'] == 'Строчка':
-            if material['strochka'] and material['strochka'].strip().lower() == user_name:
-                current_count = material['strochka_count']
-                operation_field = 'strochka_count'
-                found = True
-        elif user['job'] == 'Горло':
-            if material['gorlo'] and material['gorlo'].strip().lower() == user_name:
-                current_count = material['gorlo_count']
-                operation_field = 'gorlo_count'
-                found = True
-        elif user['job'] == 'Утюг':
-            if material['ytyg'] and material['ytyg'].strip().lower() == user_name:
-                current_count = material['ytyg_count']
-                operation_field = 'ytyg_count'
-                found = True
-        elif user['job'] == 'OTK':
-            if material['otk'] and material['otk'].strip().lower() == user_name:
-                current_count = material['otk_count']
-                operation_field = 'otk_count'
-                found = True
-        elif user['job'] == 'Упаковка':
-            if material['ypakovka'] and material['ypakovka'].strip().lower() == user_name:
-                current_count = material['ypakovka_count']
-                operation_field = 'ypakovka_count'
-                found = True
-
-        if found and current_count is not None:
-            user_materials.append({
-                'material': material,
-                'current_count': current_count,
-                'operation_field': operation_field
-            })
-            print(
-                f"   ✅ Добавлена запись: ID={material['id']}, цвет={material['color']}, count={current_count}, поле={operation_field}")
-
-    print(f"✅ Всего найдено записей: {len(user_materials)}")
-
-    if not user_materials:
+    if not materials:
         await call.message.answer(
-            f"В партии №{batch_number} у вас нет записанных работ.\n"
-            f"Имя для поиска: '{user['name']}' (в нижнем регистре: '{user_name}')"
+            f"В партии №{batch_number} у вас нет записанных работ."
         )
         await state.clear()
         await call.answer()
         return
 
+    # В состоянии только ключи (ID материала, этап) - сами материалы
+    # перечитываются по ID на следующем шаге
     await state.set_state(EditOperationsStates.waiting_for_color_selection)
     await state.update_data(
         party_id=party['id'],
         batch_number=batch_number,
-        user_materials=user_materials
+        edit_keys=[[material['id'], stage] for material in materials]
     )
 
-    builder = InlineKeyboardBuilder()
-
-    for item in user_materials:
-        material = item['material']
-        current_count = item['current_count']
-        operation_field = item['operation_field']
-
-        # Определяем название операции
-        operation_name = {
-            'four_x_count': '4-х',
-            'raspash_count': 'Распаш',
-            'beika_count': 'Бейка',
-            'strochka_count': 'Строчка',
-            'gorlo_count': 'Горло',
-            'ytyg_count': 'Утюг',
-            'otk_count': 'ОТК',
-            'ypakovka_count': 'Упаковка'
-        }.get(operation_field, 'работа')
-
-        # ИСПРАВЛЕНИЕ: Проверяем что генерируем
-        callback_data = f"edit_count_{material['id']}_{operation_field}"
-        print(f"   📝 Генерируем колбэк: {callback_data}")
+    operation_field = STAGE_COLUMNS[stage][1]
+    operation_name = STAGE_TITLES[stage]
 
+    builder = InlineKeyboardBuilder()
+    for material in materials:
+        count = material['own_count'] if COUNT_SUBMISSION_MODE == 'increment' else material[operation_field]
         builder.button(
-            text=f"🎨 {material['color']} ({operation_name}): {current_count}шт",
-            callback_data=callback_data
+            text=f"🎨 {material['color']} ({operation_name}): {count}шт",
+            callback_data=f"edit_count_{material['id']}_{stage}"
         )
 
     builder.button(text="❌ Отмена", callback_data="cancel_edit")
@@ -239,84 +123,48 @@ async def edit_party_selected(call: types.CallbackQuery, state: FSMContext):
     await call.answer()
 
 
-async def edit_color_selected(call: types.CallbackQuery, state: FSMContext):
+async def edit_color_selected(call: types.CallbackQuery, state: FSMContext, user):
     """Выбор записи для изменения КОЛИЧЕСТВА футболок"""
-    print(f"🔍 Колбэк данные: {call.data}")
-
-    # ИСПРАВЛЕНИЕ: Правильно разбираем колбэк-данные
     if not call.data.startswith("edit_count_"):
         # Это не наш колбэк, пропускаем
         await call.answer()
         return
 
-    parts = call.data.split("_")
-    print(f"🔍 Разбитые части: {parts}")
-
-    if len(parts) < 4:
+    # edit_count_31_four_x; в старых кнопках этап записан как four_x_count
+    parts = call.data.split("_", 3)
+    if len(parts) < 4 or not parts[2].isdigit():
         await call.message.answer("Некорректный запрос")
         await call.answer()
         return
 
-    # parts: ['edit', 'count', '31', 'four'] или ['edit', 'count', '31', 'four', 'x', 'count']
     material_id = int(parts[2])
+    stage = parts[3].removesuffix('_count')
 
-    # ИСПРАВЛЕНИЕ: Правильно собираем operation_field
-    if len(parts) == 4:
-        # Старый формат: edit_count_31_four
-        operation_field = parts[3]  # 'four'
-    else:
-        # Новый формат: edit_count_31_four_x_count
-        operation_field = '_'.join(parts[3:])  # 'four_x_count'
+    data = await state.get_data()
+    edit_keys = {(key_material_id, key_stage) for key_material_id, key_stage in data.get('edit_keys', [])}
 
-    print(f"🔍 Выбран материал ID: {material_id}, поле: {operation_field}")
+    # Материал перечитываем по первичному ключу: в состоянии его копии нет
+    material = await db.get_material_by_id(material_id) if (material_id, stage) in edit_keys else None
 
-    data = await state.get_data()
-    user_materials = data.get('user_materials', [])
-
-    print(f"🔍 Всего материалов в списке: {len(user_materials)}")
-    print(f"🔍 Ожидаемые поля в списке:")
-    for i, item in enumerate(user_materials):
-        print(f"   {i}: ID={item['material']['id']}, поле={item['operation_field']}")
-
-    # Находим выбранный материал
-    selected_item = None
-    for i, item in enumerate(user_materials):
-        if item['material']['id'] == material_id:
-            # ИСПРАВЛЕНИЕ: Проверяем только material_id, так как operation_field может не совпадать
-            selected_item = item
-            print(f"✅ Найден выбранный элемент по ID")
-            break
-
-    if not selected_item:
-        print(f"❌ Запись не найдена: material_id={material_id}")
+    if not material:
+        print(f"❌ Запись не найдена: material_id={material_id}, этап={stage}")
         await call.message.answer("Запись не найдена")
         await state.clear()
         await call.answer()
         return
 
-    # ИСПРАВЛЕНИЕ: Берем operation_field из найденного элемента, а не из колбэка
-    current_count = selected_item['current_count']
-    operation_field = selected_item['operation_field']  # Используем правильное поле
-
-    material = selected_item['material']
-
-    print(f"✅ Материал найден: цвет={material['color']}, count={current_count}, поле={operation_field}")
+    # В режиме increment колонка этапа - сумма всех работников, свое - по журналу
+    if COUNT_SUBMISSION_MODE == 'increment':
+        current_count = await db.get_user_material_stage_total(material_id, stage, user['id'])
+    else:
+        current_count = material[STAGE_COLUMNS[stage][1]] or 0
+    operation_name = STAGE_TITLES[stage]
 
-    # Определяем название операции
-    operation_name = {
-        'four_x_count': '4-х',
-        'raspash_count': 'Распаш',
-        'beika_count': 'Бейка',
-        'strochka_count': 'Строчка',
-        'gorlo_count': 'Горло',
-        'ytyg_count': 'Утюг',
-        'otk_count': 'ОТК',
-        'ypakovka_count': 'Упаковка'
-    }.get(operation_field, 'работа')
+    print(f"✅ Материал найден: цвет={material['color']}, count={current_count}, этап={stage}")
 
     await state.update_data(
         material_id=material_id,
-        edit_op_field=operation_field,
+        edit_stage=stage,
         edit_op_name=operation_name,
         current_count=current_count
     )
@@ -347,32 +195,51 @@ async def edit_color_selected(call: types.CallbackQuery, state: FSMContext):
     await call.answer()
 
 
-async def edit_count_handler(message: types.Message, state: FSMContext):
+async def edit_count_handler(message: types.Message, state: FSMContext, user):
     """Обработка нового количества футболок"""
     try:
         new_count = int(message.text)
+        if new_count < 0:
+            await message.answer("Количество не может быть отрицательным. Введите снова:")
+            return
         data = await state.get_data()
 
         material_id = data.get('material_id')
-        op_field = data.get('edit_op_field')
+        stage = data.get('edit_stage')
         op_name = data.get('edit_op_name')
         batch_number = data.get('batch_number')
         current_count = data.get('current_count')
 
-        if not material_id or not op_field:
+        if not material_id or stage not in STAGE_COLUMNS:
             await message.answer("Ошибка: данные не найдены")
             await state.clear()
             return
 
-        # Обновляем количество в БД
-        async with db.pool.acquire() as conn:
-            await conn.execute(
-                f"UPDATE materials SET {op_field} = $1 WHERE id = $2",
-                new_count, material_id
+        # Обновляем количество в БД и пишем корректировку в журнал работ;
+        # обновленная строка материала возвращается тем же запросом
+        if COUNT_SUBMISSION_MODE == 'increment':
+            # Колонка этапа - общая сумма: сдвигаем ее и журнал работника
+            # на разницу с его собственной суммой, перечитанной сейчас
+            current_count = await db.get_user_material_stage_total(material_id, stage, user['id'])
+            material = await db.record_operation(
+                stage,
+                material_id,
+                new_count - current_count,
+                tg_id=message.from_user.id,
+                increment=True
+            )
+        else:
+            material = await db.record_operation(
+                stage,
+                material_id,
+                new_count,
+                tg_id=message.from_user.id
             )
 
-        # Получаем материал для информации о цвете
-        material = await db.get_material_by_id(material_id)
+        if not material:
+            await message.answer("Материал не найден, возможно он был удален")
+            await state.clear()
+            return
 
         # Вычисляем разницу
         difference = new_count - current_count
@@ -1,9 +1,10 @@
 from aiogram import types
 from aiogram.fsm.context import FSMContext
 
+from config import COUNT_SUBMISSION_MODE
 from db import db
 from keyboards import get_cancel_keyboard
-from service import user_service, keyboard_service, user_sessions
+from service import user_service, keyboard_service
 from states import FourXStates
 
 
@@ -25,10 +26,6 @@ async def fourx_party_selected(call: types.CallbackQuery, state: FSMContext):
         await call.answer()
         return
 
-    # Получаем должность пользователя для отображения правильной клавиатуры
-    user = await db.get_user(call.from_user.id)
-    user_job = user['job'] if user else None
-
     keyboard = await keyboard_service.get_colors_keyboard(party['id'])
     if not keyboard.inline_keyboard:
         await call.message.answer("В этой партии пока нет материалов")
@@ -45,7 +42,7 @@ async def fourx_party_selected(call: types.CallbackQuery, state: FSMContext):
     await call.answer()
 
 
-async def fourx_color_selected(call: types.CallbackQuery, state: FSMContext):
+async def fourx_color_selected(call: types.CallbackQuery, state: FSMContext, user):
     material_id = int(call.data.split("_")[1])
 
     # Получаем информацию о материале
@@ -53,9 +50,9 @@ async def fourx_color_selected(call: types.CallbackQuery, state: FSMContext):
     color = material['color'] if material else "выбранный"
 
     try:
-        # Получаем номер машинки пользователя из БД
-        machine_number = await user_service.get_user_machine_number(call.from_user.id)
-        user_name = await user_service.get_user_name(call.from_user.id)
+        # Номер машинки пользователя из БД
+        machine_number = user.get('machine_number') if user else None
+        user_name = user['name'] if user else None
 
         if not machine_number:
             # Если номер машинки не указан, просим указать
@@ -90,12 +87,12 @@ async def fourx_color_selected(call: types.CallbackQuery, state: FSMContext):
     await call.answer()
 
 
-async def fourx_machine_handler(message: types.Message, state: FSMContext):
+async def fourx_machine_handler(message: types.Message, state: FSMContext, user):
     """Обработка номера машинки для 4-х оператора (если не было при регистрации)"""
     machine_number = message.text.strip()
     data = await state.get_data()
     color = data.get('color', 'выбранный')
-    user_name = await user_service.get_user_name(message.from_user.id)
+    user_name = user['name'] if user else None
 
     await state.update_data(four_x=machine_number)
     await state.set_state(FourXStates.waiting_for_count)
@@ -117,20 +114,30 @@ async def fourx_machine_handler(message: types.Message, state: FSMContext):
         await state.clear()
 
 
-async def fourx_count_handler(message: types.Message, state: FSMContext):
+async def fourx_count_handler(message: types.Message, state: FSMContext, user):
     try:
         count = int(message.text)
+        if count <= 0:
+            await message.answer("Количество должно быть больше 0. Введите снова:")
+            return
         data = await state.get_data()
-        user_name = await user_service.get_user_name(message.from_user.id)
-        await db.update_fourx(data['material_id'], user_name, count)
-        await message.answer(
-            f"✅ Записано: {count}шт\n"
+        user_name = user['name'] if user else None
+        material = await db.record_operation(
+            'four_x', data['material_id'], count,
+            worker=user_name, tg_id=message.from_user.id,
+            increment=COUNT_SUBMISSION_MODE == 'increment'
         )
+        if not material:
+            await message.answer("Материал не найден, возможно он был удален")
+            await state.clear()
+            return
+        result_text = f"✅ Записано: {count}шт\n"
+        if COUNT_SUBMISSION_MODE == 'increment':
+            result_text += f"Всего по цвету: {material['four_x_count']}шт\n"
+        await message.answer(result_text)
 
         # Сохраняем текущую партию
-        if message.from_user.id not in user_sessions:
-            user_sessions[message.from_user.id] = {}
-        user_sessions[message.from_user.id]['current_party'] = data['batch_number']
+        user_service.set_current_party(message.from_user.id, data['batch_number'])
 
         # Предлагаем продолжить или сменить партию
         from aiogram.utils.keyboard import InlineKeyboardBuilder
@@ -156,10 +163,8 @@ async def fourx_count_handler(message: types.Message, state: FSMContext):
         await message.answer("Пожалуйста, введите число:")
 
 
-async def fourx_start_menu(message: types.Message, state: FSMContext):
+async def fourx_start_menu(message: types.Message, state: FSMContext, user):
     """Запуск работы для 4-х через меню (кнопку)"""
-    user = await db.get_user(message.from_user.id)
-
     await state.set_state(FourXStates.waiting_for_party_selection)
 
     keyboard = await keyboard_service.get_parties_keyboard(
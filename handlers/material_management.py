@@ -5,17 +5,17 @@ from aiogram.utils.keyboard import InlineKeyboardBuilder
 
 from db import db
 from keyboards import get_cancel_keyboard
-from service import party_service, user_service
+from roles import Role
+from service import party_service
 from states import ZakroiStates, MaterialManagementStates
 
 
 
-async def manage_materials_callback(call: types.CallbackQuery):
+async def manage_materials_callback(call: types.CallbackQuery, user):
     """Управление материалами партии - УПРОЩЕННОЕ"""
     party_id = int(call.data.split("_")[2])
 
-    user = await db.get_user(call.from_user.id)
-    if not user or not user_service.is_zakroi_sync(user['job']):
+    if not user or user['role'] is not Role.ZAKROI:
         await call.message.answer("Только закройщик может управлять материалами")
         await call.answer()
         return
@@ -103,7 +103,7 @@ async def delete_material_callback(call: types.CallbackQuery, state: FSMContext)
     await call.answer()
 
 
-async def confirm_material_delete(call: types.CallbackQuery, state: FSMContext):
+async def confirm_material_delete(call: types.CallbackQuery, state: FSMContext, user):
     """Подтверждение удаления материала"""
     data = await state.get_data()
     material_id = data.get('material_id')
@@ -135,7 +135,7 @@ async def confirm_material_delete(call: types.CallbackQuery, state: FSMContext):
     # Возвращаемся к управлению цветами
     if party_id:
         fake_call = create_fake_call(call, f"manage_colors_{party_id}")
-        await manage_colors_callback(fake_call)
+        await manage_colors_callback(fake_call, user=user)
 
     await call.answer()
 
@@ -152,7 +152,7 @@ def create_fake_call(original_call, callback_data):
     return FakeCallback(original_call, callback_data)
 
 
-async def cancel_material_delete(call: types.CallbackQuery, state: FSMContext):
+async def cancel_material_delete(call: types.CallbackQuery, state: FSMContext, user):
     """Отмена удаления материала"""
     data = await state.get_data()
     party_id = data.get('party_id')
@@ -171,10 +171,10 @@ async def cancel_material_delete(call: types.CallbackQuery, state: FSMContext):
                 self.data = f"manage_colors_{party_id}"
 
         fake_call = FakeCallback(call, party_id)
-        await manage_colors_callback(fake_call)
+        await manage_colors_callback(fake_call, user=user)
 
 
-async def party_back_callback(call: types.CallbackQuery):
+async def party_back_callback(call: types.CallbackQuery, user):
     """Возврат к просмотру партии"""
     party_id = int(call.data.split("_")[2])
 
@@ -184,7 +184,6 @@ async def party_back_callback(call: types.CallbackQuery):
         await call.answer()
         return
 
-    user = await db.get_user(call.from_user.id)
     user_job = user['job'] if user else None
 
     info = await party_service.format_party_info(party_id, user_job)
@@ -203,7 +202,7 @@ async def party_back_callback(call: types.CallbackQuery):
     await call.answer()
 
 
-async def manage_colors_callback(call: types.CallbackQuery = None, party_id: int = None):
+async def manage_colors_callback(call: types.CallbackQuery = None, party_id: int = None, user=None):
     """Управление цветами - УПРОЩЕННОЕ (только изменение)"""
     # Если вызываем из confirm_material_delete, call.data будет неправильным
     # Поэтому передаем party_id отдельно
@@ -222,16 +221,12 @@ async def manage_colors_callback(call: types.CallbackQuery = None, party_id: int
             await call.answer()
         return
 
-    # Получаем user_id из call или создаем фейковый
-    user_id = call.from_user.id if call else None
-
-    if user_id:
-        user = await db.get_user(user_id)
-        if not user or not user_service.is_zakroi_sync(user['job']):
-            await call.message.answer("Только закройщик может управлять цветами")
-            if call:
-                await call.answer()
-            return
+    # Пользователь приходит из middleware или от вызывающего обработчика
+    if not user or user['role'] is not Role.ZAKROI:
+        await call.message.answer("Только закройщик может управлять цветами")
+        if call:
+            await call.answer()
+        return
 
     party = await db.get_party_by_id(party_id)
     materials = await db.get_materials_by_party(party_id)
@@ -282,13 +277,12 @@ async def manage_colors_callback(call: types.CallbackQuery = None, party_id: int
         await call.answer()
 
 
-async def edit_color_callback(call: types.CallbackQuery, state: FSMContext):
+async def edit_color_callback(call: types.CallbackQuery, state: FSMContext, user):
     """Редактирование цвета материала - ТОЛЬКО для закройщика"""
     material_id = int(call.data.split("_")[2])
 
     # Проверяем права
-    user = await db.get_user(call.from_user.id)
-    if not user or not user_service.is_zakroi_sync(user['job']):
+    if not user or user['role'] is not Role.ZAKROI:
         await call.message.answer("Только закройщик может изменять цвета материалов")
         await call.answer()
         return
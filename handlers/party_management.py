@@ -3,24 +3,19 @@ from aiogram.fsm.context import FSMContext
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
 from db import db
-from keyboards import  get_parties_keyboard, is_zakroi_sync, normalize_job_sync
+from roles import Role
+from service import keyboard_service
 from states import PartyManagementStates
 
 
-async def party_management_start(message: types.Message, state: FSMContext):
+async def party_management_start(message: types.Message, state: FSMContext, user):
     """Начало управления партиями"""
-    user = await db.get_user(message.from_user.id)
-
     if not user:
         print(f"❌ Пользователь не найден")
         await message.answer("Сначала пройдите регистрацию через /start")
         return
 
-    # Детальная проверка
-    normalized_job = normalize_job_sync(user['job'])
-    is_zakroi = is_zakroi_sync(user['job'])
-
-    if not is_zakroi:
+    if user['role'] is not Role.ZAKROI:
         await message.answer("Эта функция доступна только закройщикам")
         return
 
@@ -94,7 +89,7 @@ async def delete_party_start(call: types.CallbackQuery, state: FSMContext):
     await state.set_state(PartyManagementStates.waiting_for_party_selection)
 
     # Используем клавиатуру с кнопками удаления
-    keyboard = get_parties_keyboard(parties, user_job='Закрой', with_management=True)
+    keyboard = await keyboard_service.get_parties_keyboard('Закрой', with_management=True)
 
     await call.message.edit_text(
         "🗑️ Выберите партию для удаления:\n"
@@ -179,18 +174,17 @@ async def cancel_party_deletion(call: types.CallbackQuery, state: FSMContext):
     await call.answer()
 
 
-async def manage_parties_callback(call: types.CallbackQuery, state: FSMContext):
+async def manage_parties_callback(call: types.CallbackQuery, state: FSMContext, user):
     """Обработка кнопки 'Управление партиями'"""
-    user = await db.get_user(call.from_user.id)
-    if not user or user['job'] != 'Закрой':
+    if not user or user['role'] is not Role.ZAKROI:
         await call.message.answer("Эта функция доступна только закройщикам")
         await call.answer()
         return
 
-    await party_management_start(call.message, state)
+    await party_management_start(call.message, state, user)
     await call.answer()
 
 
-async def party_management_menu(message: types.Message, state: FSMContext):
+async def party_management_menu(message: types.Message, state: FSMContext, user):
     """Обработка кнопки 'Управление партиями' из меню"""
-    await party_management_start(message, state)
\ No newline at end of file
+    await party_management_start(message, state, user)
\ No newline at end of file
@@ -1,9 +1,10 @@
 from aiogram import types
 from aiogram.fsm.context import FSMContext
 
+from config import COUNT_SUBMISSION_MODE
 from db import db
 from keyboards import get_cancel_keyboard
-from service import user_service, keyboard_service, user_sessions
+from service import keyboard_service, user_service
 from states import RaspashStates
 
 
@@ -40,13 +41,13 @@ async def raspash_party_selected(call: types.CallbackQuery, state: FSMContext):
     await call.answer()
 
 
-async def raspash_color_selected(call: types.CallbackQuery, state: FSMContext):
+async def raspash_color_selected(call: types.CallbackQuery, state: FSMContext, user):
     material_id = int(call.data.split("_")[1])
 
     # Получаем информацию о материале
     material = await db.get_material_by_id(material_id)
     color = material['color'] if material else "выбранный"
-    user_name = await user_service.get_user_name(call.from_user.id)
+    user_name = user['name'] if user else None
 
     await state.update_data(material_id=material_id, color=color)
     await state.set_state(RaspashStates.waiting_for_count)
@@ -60,23 +61,33 @@ async def raspash_color_selected(call: types.CallbackQuery, state: FSMContext):
     await call.answer()
 
 
-async def raspash_count_handler(message: types.Message, state: FSMContext):
+async def raspash_count_handler(message: types.Message, state: FSMContext, user):
     try:
         count = int(message.text)
+        if count <= 0:
+            await message.answer("Количество должно быть больше 0. Введите снова:")
+            return
         data = await state.get_data()
-        user_name = await user_service.get_user_name(message.from_user.id)
+        user_name = user['name'] if user else None
 
-        await db.update_raspash(data['material_id'], user_name, count)
+        material = await db.record_operation(
+            'raspash', data['material_id'], count,
+            worker=user_name, tg_id=message.from_user.id,
+            increment=COUNT_SUBMISSION_MODE == 'increment'
+        )
+        if not material:
+            await message.answer("Материал не найден, возможно он был удален")
+            await state.clear()
+            return
 
         # Упрощенное сообщение об успехе
-        await message.answer(
-            f"✅ Записано: {count}шт\n"
-        )
+        result_text = f"✅ Записано: {count}шт\n"
+        if COUNT_SUBMISSION_MODE == 'increment':
+            result_text += f"Всего по цвету: {material['raspash_count']}шт\n"
+        await message.answer(result_text)
 
         # Сохраняем текущую партию
-        if message.from_user.id not in user_sessions:
-            user_sessions[message.from_user.id] = {}
-        user_sessions[message.from_user.id]['current_party'] = data['batch_number']
+        user_service.set_current_party(message.from_user.id, data['batch_number'])
 
         # Предлагаем продолжить или сменить партию
         from aiogram.utils.keyboard import InlineKeyboardBuilder
@@ -116,10 +127,8 @@ async def raspash_start_inline(message: types.Message, state: FSMContext):
     await raspash_start(fake_call, state)
 
 
-async def raspash_start_menu(message: types.Message, state: FSMContext):
+async def raspash_start_menu(message: types.Message, state: FSMContext, user):
     """Запуск работы для распаш через меню (кнопку)"""
-    user = await db.get_user(message.from_user.id)
-
     await state.set_state(RaspashStates.waiting_for_party_selection)
 
     keyboard = await keyboard_service.get_parties_keyboard(
@@ -7,15 +7,13 @@ from keyboards import get_jobs_keyboard, get_main_menu_keyboard
 from states import RegistrationStates
 from config import ZAKROISHCHIK_ID
 
-async def name_handler(message: types.Message, state: FSMContext):
+async def name_handler(message: types.Message, state: FSMContext, user):
     name = message.text.strip()
 
     # Проверяем, является ли пользователь закройщиком
     if message.from_user.id == ZAKROISHCHIK_ID:
         # Это закройщик - сразу регистрируем/обновляем
-        existing_user = await db.get_user(ZAKROISHCHIK_ID)
-
-        if not existing_user:
+        if not user:
             # Регистрируем как закройщика
             await db.add_user(
                 tg_id=ZAKROISHCHIK_ID,
@@ -25,11 +23,7 @@ async def name_handler(message: types.Message, state: FSMContext):
             )
         else:
             # Обновляем имя если нужно
-            async with db.pool.acquire() as conn:
-                await conn.execute(
-                    "UPDATE users SET name = $1 WHERE tg_id = $2",
-                    name, ZAKROISHCHIK_ID
-                )
+            await db.rename_user(ZAKROISHCHIK_ID, name)
 
         await state.clear()
         await message.answer(
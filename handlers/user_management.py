@@ -3,23 +3,17 @@ from aiogram.fsm.context import FSMContext
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
 from db import db
-from keyboards import  is_zakroi_sync
+from roles import Role
 from states import UserManagementStates
 
 
-async def user_management_start(message: types.Message, state: FSMContext):
+async def user_management_start(message: types.Message, state: FSMContext, user):
     """Начало управления пользователями"""
-    user = await db.get_user(message.from_user.id)
-
     if not user:
         await message.answer("Сначала пройдите регистрацию через /start")
         return
 
-    # Используем синхронную проверку из keyboards.py
-    is_zakroi = is_zakroi_sync(user['job'])
-
-
-    if not is_zakroi:
+    if user['role'] is not Role.ZAKROI:
         await message.answer("Эта функция доступна только закройщикам")
         return
 
@@ -160,6 +154,6 @@ async def cancel_user_deletion(call: types.CallbackQuery, state: FSMContext):
     await call.answer()
 
 
-async def user_management_menu(message: types.Message, state: FSMContext):
+async def user_management_menu(message: types.Message, state: FSMContext, user):
     """Обработка кнопки 'Управление пользователями' из меню"""
-    await user_management_start(message, state)
\ No newline at end of file
+    await user_management_start(message, state, user)
\ No newline at end of file
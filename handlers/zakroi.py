@@ -4,15 +4,15 @@ from aiogram.fsm.context import FSMContext
 
 from db import db
 from keyboards import get_cancel_keyboard, get_main_menu_keyboard
-from service import  user_sessions
+from roles import Role
+from service import user_service
 from states import ZakroiStates
 from config import ZAKROISHCHIK_ID
 
 
-async def zakroi_start_menu(message: types.Message, state: FSMContext):
+async def zakroi_start_menu(message: types.Message, state: FSMContext, user):
     """Запуск работы для закройщика через меню (кнопку)"""
-    user = await db.get_user(message.from_user.id)
-    if not user or user['job'] != 'Закрой':
+    if not user or user['role'] is not Role.ZAKROI:
         await message.answer("Только закройщик может создавать новые записи")
         return
 
@@ -30,8 +30,8 @@ async def zakroi_start_menu(message: types.Message, state: FSMContext):
         return
 
     # Если партии есть, показываем список для выбора
-    from keyboards import get_parties_keyboard
-    keyboard = get_parties_keyboard(parties, user['job'], with_management=False)
+    from service import keyboard_service
+    keyboard = await keyboard_service.get_parties_keyboard(user['job'], with_management=False)
 
     await message.answer(
         "Выберите партию для добавления материала:",
@@ -122,11 +122,7 @@ async def zakroi_design_handler(message: types.Message, state: FSMContext):
         else:
             # Партия уже есть - обновляем дизайн
             try:
-                async with db.pool.acquire() as conn:
-                    await conn.execute(
-                        "UPDATE parties SET design = $1 WHERE batch_number = $2",
-                        design, batch_number
-                    )
+                await db.update_party_design(batch_number, design)
             except Exception as e:
                 print(f"❌ Ошибка при обновлении дизайна: {e}")
                 import traceback
@@ -159,7 +155,7 @@ async def zakroi_design_handler(message: types.Message, state: FSMContext):
         await state.clear()
 
 
-async def zakroi_color_handler(message: types.Message, state: FSMContext):
+async def zakroi_color_handler(message: types.Message, state: FSMContext, user):
     color = message.text.strip()
     data = await state.get_data()
 
@@ -168,11 +164,7 @@ async def zakroi_color_handler(message: types.Message, state: FSMContext):
         material_id = data.get('material_id')
 
         # Обновляем цвет в БД
-        async with db.pool.acquire() as conn:
-            await conn.execute(
-                "UPDATE materials SET color = $1 WHERE id = $2",
-                color, material_id
-            )
+        await db.update_material_color(material_id, color)
 
         party = await db.get_party_by_id(data['party_id'])
 
@@ -197,7 +189,7 @@ async def zakroi_color_handler(message: types.Message, state: FSMContext):
 
         # Вызываем через create_task чтобы избежать проблем с answer
         import asyncio
-        asyncio.create_task(manage_colors_callback(fake_call))
+        asyncio.create_task(manage_colors_callback(fake_call, user=user))
 
         await state.clear()
     else:
@@ -212,7 +204,7 @@ async def zakroi_color_handler(message: types.Message, state: FSMContext):
         )
 
 
-async def zakroi_quantity_handler(message: types.Message, state: FSMContext):
+async def zakroi_quantity_handler(message: types.Message, state: FSMContext, user):
     try:
         quantity_line = int(message.text)
         if quantity_line <= 0:
@@ -237,8 +229,7 @@ async def zakroi_quantity_handler(message: types.Message, state: FSMContext):
         )
 
         if success:
-            # Получаем пользователя и информацию о партии
-            user = await db.get_user(message.from_user.id)
+            # Должность пользователя и информация о партии
             user_job = user['job'] if user else None
 
             party = await db.get_party_by_id(data['party_id'])
@@ -275,9 +266,7 @@ async def zakroi_quantity_handler(message: types.Message, state: FSMContext):
                         f"Футболок: {tshirt_count} (автоматически рассчитано: {quantity_line} × 5)"
                     )
 
-                    if message.from_user.id not in user_sessions:
-                        user_sessions[message.from_user.id] = {}
-                    user_sessions[message.from_user.id]['current_party'] = data['batch_number']
+                    user_service.set_current_party(message.from_user.id, data['batch_number'])
 
         else:
             await message.answer("❌ Ошибка при добавлении записи")
@@ -290,11 +279,9 @@ async def zakroi_quantity_handler(message: types.Message, state: FSMContext):
 
 
 # Обработчики для кнопок меню
-async def new_party_command(message: types.Message, state: FSMContext):
+async def new_party_command(message: types.Message, state: FSMContext, user):
     """Создание новой партии через команду"""
-
-    user = await db.get_user(message.from_user.id)
-    if not user or user['job'] != 'Закрой':
+    if not user or user['role'] is not Role.ZAKROI:
         await message.answer("Только закройщик может создавать новые партии")
         return
 
@@ -305,11 +292,9 @@ async def new_party_command(message: types.Message, state: FSMContext):
     )
 
 
-async def new_party_callback(call: types.CallbackQuery, state: FSMContext):
+async def new_party_callback(call: types.CallbackQuery, state: FSMContext, user):
     """Создание новой партии из меню"""
-
-    user = await db.get_user(call.from_user.id)
-    if not user or user['job'] != 'Закрой':
+    if not user or user['role'] is not Role.ZAKROI:
         await call.message.answer("Только закройщик может создавать новые партии")
         await call.answer()
         return
@@ -0,0 +1,159 @@
+"""Массовый импорт партий и материалов из CSV (раскройные листы).
+
+Ожидаемые колонки (заголовок обязателен, порядок любой):
+    партия, дизайн, цвет, линий[, футболок]
+или те же по-английски: batch_number, design, color, quantity_line[, tshirt_count].
+Если количество футболок не указано, оно считается как линий × 5 - как при
+ручном вводе закройщиком.
+
+Запуск из консоли:
+    python importer.py раскрой.csv
+"""
+import asyncio
+import csv
+import io
+import sys
+
+from db import db
+
+# Заголовок колонки -> поле
+COLUMN_ALIASES = {
+    'batch_number': 'batch_number',
+    'партия': 'batch_number',
+    'design': 'design',
+    'дизайн': 'design',
+    'color': 'color',
+    'цвет': 'color',
+    'quantity_line': 'quantity_line',
+    'линий': 'quantity_line',
+    'линии': 'quantity_line',
+    'tshirt_count': 'tshirt_count',
+    'футболок': 'tshirt_count',
+    'футболки': 'tshirt_count',
+}
+
+REQUIRED_FIELDS = ('batch_number', 'color', 'quantity_line')
+
+# Длины колонок в БД (parties.batch_number, parties.design, materials.color)
+MAX_BATCH_NUMBER_LENGTH = 50
+MAX_TEXT_LENGTH = 100
+
+# Чтобы не засыпать чат, показываем только первые ошибки
+MAX_REPORTED_ERRORS = 10
+
+
+def decode_csv(raw: bytes) -> str:
+    """Excel сохраняет CSV то в UTF-8 (с BOM), то в cp1251"""
+    try:
+        return raw.decode('utf-8-sig')
+    except UnicodeDecodeError:
+        return raw.decode('cp1251')
+
+
+def parse_materials_csv(text: str):
+    """Разобрать и проверить CSV. Возвращает (строки, ошибки).
+
+    Каждая строка - кортеж (batch_number, design, color, quantity_line, tshirt_count).
+    """
+    # Разделитель определяем по заголовку: русский Excel сохраняет через ";"
+    first_line = text.split('\n', 1)[0]
+    delimiter = max(';\t,', key=first_line.count)
+
+    reader = csv.reader(io.StringIO(text), delimiter=delimiter)
+    header = next(reader, None)
+    if not header:
+        return [], ["Файл пустой"]
+
+    fields = [COLUMN_ALIASES.get(column.strip().lower()) for column in header]
+    missing = [field for field in REQUIRED_FIELDS if field not in fields]
+    if missing:
+        return [], [f"Нет обязательных колонок: {', '.join(missing)}"]
+
+    rows = []
+    errors = []
+
+    for line_number, values in enumerate(reader, start=2):
+        if not any(value.strip() for value in values):
+            continue
+
+        record = {
+            field: value.strip()
+            for field, value in zip(fields, values)
+            if field
+        }
+
+        batch_number = record.get('batch_number', '')
+        design = record.get('design', '')
+        color = record.get('color', '')
+
+        if not batch_number:
+            errors.append(f"Строка {line_number}: не указан номер партии")
+            continue
+        if len(batch_number) > MAX_BATCH_NUMBER_LENGTH:
+            errors.append(f"Строка {line_number}: номер партии длиннее {MAX_BATCH_NUMBER_LENGTH} символов")
+            continue
+        if not color:
+            errors.append(f"Строка {line_number}: не указан цвет")
+            continue
+        if len(color) > MAX_TEXT_LENGTH:
+            errors.append(f"Строка {line_number}: цвет длиннее {MAX_TEXT_LENGTH} символов")
+            continue
+        if len(design) > MAX_TEXT_LENGTH:
+            errors.append(f"Строка {line_number}: дизайн длиннее {MAX_TEXT_LENGTH} символов")
+            continue
+
+        try:
+            quantity_line = int(record.get('quantity_line', ''))
+        except ValueError:
+            errors.append(f"Строка {line_number}: количество линий должно быть числом")
+            continue
+        if quantity_line <= 0:
+            errors.append(f"Строка {line_number}: количество линий должно быть больше 0")
+            continue
+
+        if record.get('tshirt_count'):
+            try:
+                tshirt_count = int(record['tshirt_count'])
+            except ValueError:
+                errors.append(f"Строка {line_number}: количество футболок должно быть числом")
+                continue
+            if tshirt_count < 0:
+                errors.append(f"Строка {line_number}: количество футболок не может быть отрицательным")
+                continue
+        else:
+            tshirt_count = quantity_line * 5
+
+        rows.append((batch_number, design or None, color, quantity_line, tshirt_count))
+
+    if not rows and not errors:
+        errors.append("В файле нет строк с материалами")
+
+    return rows, errors
+
+
+async def main(path: str):
+    with open(path, 'rb') as f:
+        rows, errors = parse_materials_csv(decode_csv(f.read()))
+
+    if errors:
+        print(f"❌ Найдено ошибок: {len(errors)}, импорт не выполнен")
+        for error in errors:
+            print(f"   {error}")
+        return 1
+
+    await db.create_pool()
+    try:
+        parties_created, materials_added = await db.import_materials(rows)
+    finally:
+        await db.close_pool()
+
+    print(f"✅ Импорт завершен: новых партий {parties_created}, материалов {materials_added}")
+    return 0
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Использование: python importer.py файл.csv")
+        sys.exit(2)
+
+    sys.exit(asyncio.run(main(sys.argv[1])))
@@ -1,97 +1,54 @@
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardMarkup, KeyboardButton
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
-# Словарь для преобразования должностей (синхронный)
-JOB_TRANSLATION = {
-    'zakroi': 'Закрой',
-    'Закрой': 'Закрой',
-    'fourx': '4-х',
-    '4-х': '4-х',
-    'raspash': 'Распаш',
-    'Распаш': 'Распаш',
-    'beika': 'Бейка',
-    'Бейка': 'Бейка',
-    'strochka': 'Строчка',
-    'Строчка': 'Строчка',
-    'gorlo': 'Горло',
-    'Горло': 'Горло',
-    'ytyg': 'Утюг',
-    'Утюг': 'Утюг',
-    'otk': 'OTK',
-    'OTK': 'OTK',
-    'upakovka': 'Упаковка',
-    'Упаковка': 'Упаковка'
-}
-
-
-# Синхронная функция нормализации должности
-def normalize_job_sync(job: str) -> str:
-    """Синхронно приводит должность к стандартному виду"""
-    if not job:
-        return job
-
-    # Сначала проверяем точное совпадение
-    if job in JOB_TRANSLATION:
-        return JOB_TRANSLATION[job]
-
-    # Проверяем регистронезависимо
-    job_lower = job.lower()
-    for key, value in JOB_TRANSLATION.items():
-        if key.lower() == job_lower:
-            return value
-
-    # Если не нашли, возвращаем как есть
-    return job
-
-
-# Синхронная функция проверки закройщика
-def is_zakroi_sync(job: str) -> bool:
-    """Синхронно проверяет является ли должность закройщиком"""
-    if not job:
-        return False
-
-    normalized = normalize_job_sync(job)
-    return normalized == 'Закрой'
+from roles import JOB_TRANSLATION, Role, is_zakroi_sync
+
+# Неизменяемые клавиатуры собираются один раз при импорте и
+# отдаются одними и теми же объектами - изменять их нельзя
+JOBS_KEYBOARD = InlineKeyboardMarkup(inline_keyboard=[
+    [
+        InlineKeyboardButton(text='4-х', callback_data='fourx'),
+        InlineKeyboardButton(text='Распаш', callback_data='raspash'),
+    ],
+    [
+        InlineKeyboardButton(text='Бейка', callback_data='beika'),
+        InlineKeyboardButton(text='Строчка', callback_data='strochka'),
+    ],
+    [
+        InlineKeyboardButton(text='Горло', callback_data='gorlo'),
+        InlineKeyboardButton(text='Утюг', callback_data='ytyg'),
+    ],
+    [
+        InlineKeyboardButton(text='OTK', callback_data='otk'),
+        InlineKeyboardButton(text='Упаковка', callback_data='upakovka'),
+    ]
+])
+
+CANCEL_KEYBOARD = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text='❌ Отмена', callback_data='cancel')]
+])
 
 
 # Клавиатура выбора должности
 def get_jobs_keyboard():
-    return InlineKeyboardMarkup(inline_keyboard=[
-        [
-            InlineKeyboardButton(text='4-х', callback_data='fourx'),
-            InlineKeyboardButton(text='Распаш', callback_data='raspash'),
-        ],
-        [
-            InlineKeyboardButton(text='Бейка', callback_data='beika'),
-            InlineKeyboardButton(text='Строчка', callback_data='strochka'),
-        ],
-        [
-            InlineKeyboardButton(text='Горло', callback_data='gorlo'),
-            InlineKeyboardButton(text='Утюг', callback_data='ytyg'),
-        ],
-        [
-            InlineKeyboardButton(text='OTK', callback_data='otk'),
-            InlineKeyboardButton(text='Упаковка', callback_data='upakovka'),
-        ]
-    ])
+    return JOBS_KEYBOARD
 
 
 # Клавиатура отмены
 def get_cancel_keyboard():
-    return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text='❌ Отмена', callback_data='cancel')]
-    ])
+    return CANCEL_KEYBOARD
 
 
 # Клавиатура выбора партии с функциями управления
 def get_parties_keyboard(parties, user_job=None, with_management=False):
     builder = InlineKeyboardBuilder()
+    is_zakroi = is_zakroi_sync(user_job)
 
     for party in parties:
         # Добавляем дизайн к названию партии
         design_text = f" ({party['design']})" if party.get('design') else ""
 
-        if with_management and normalize_job_sync(user_job) == 'Закрой':
+        if with_management and is_zakroi:
             builder.button(
                 text=f"🗑️ Партия №{party['batch_number']}{design_text}",
                 callback_data=f"delete_party_{party['batch_number']}"
@@ -102,12 +59,12 @@ def get_parties_keyboard(parties, user_job=None, with_management=False):
                 callback_data=f"party_{party['batch_number']}"
             )
 
-    if normalize_job_sync(user_job) == 'Закрой':
+    if is_zakroi:
         builder.button(text="➕ Новая партия", callback_data="new_party")
 
     builder.button(text="❌ Отмена", callback_data="cancel")
 
-    if normalize_job_sync(user_job) == 'Закрой':
+    if is_zakroi:
         if with_management:
             builder.adjust(1, 2, 1)
         else:
@@ -133,41 +90,48 @@ def get_colors_keyboard(materials):
     return builder.as_markup()
 
 
+# Кнопки главного меню по должностям
+JOB_ACTIONS = {
+    'Закрой': ['Новая запись', 'Управление партиями','Управление пользователями', 'Все партии'],
+    '4-х': ['Начать работу', 'Сменить партию', 'Мои данные', 'Изменить показания'],
+    'Распаш': ['Начать работу', 'Сменить партию', 'Мои данные', 'Изменить показания'],
+    'Бейка': ['Начать работу', 'Сменить партию', 'Мои данные', 'Изменить показания'],
+    'Строчка': ['Начать работу', 'Сменить партию', 'Мои данные', 'Изменить показания'],
+    'Горло': ['Начать работу', 'Сменить партию', 'Мои данные', 'Изменить показания'],
+    'Утюг': ['Начать работу', 'Сменить партию', 'Мои данные', 'Изменить показания'],
+    'OTK': ['Начать работу', 'Сменить партию', 'Мои данные', 'Изменить показания'],
+    'Упаковка': ['Начать работу', 'Сменить партию', 'Мои данные', 'Изменить показания']
+}
+
+
+def _build_menu(actions):
+    keyboard = [[KeyboardButton(text=action)] for action in actions]
+    return ReplyKeyboardMarkup(keyboard=keyboard, resize_keyboard=True)
+
+
+# Меню с базовыми кнопками - для неизвестной должности
+DEFAULT_MAIN_MENU_KEYBOARD = _build_menu(['Начать работу', 'Сменить партию', 'Мои данные'])
+
+# Готовое меню по должности, в т.ч. по её синонимам из JOB_TRANSLATION
+MAIN_MENU_KEYBOARDS = {job: _build_menu(actions) for job, actions in JOB_ACTIONS.items()}
+for _alias, _job in JOB_TRANSLATION.items():
+    MAIN_MENU_KEYBOARDS.setdefault(_alias, MAIN_MENU_KEYBOARDS[_job])
+
+
 # Основное меню для работников
 def get_main_menu_keyboard(job: str):
     """Основное меню для работников"""
-    # Нормализуем должность СИНХРОННО
-    normalized_job = normalize_job_sync(job)
-
-    job_actions = {
-        'Закрой': ['Новая запись', 'Управление партиями','Управление пользователями', 'Все партии'],
-        '4-х': ['Начать работу', 'Сменить партию', 'Мои данные', 'Изменить показания'],
-        'Распаш': ['Начать работу', 'Сменить партию', 'Мои данные', 'Изменить показания'],
-        'Бейка': ['Начать работу', 'Сменить партию', 'Мои данные', 'Изменить показания'],
-        'Строчка': ['Начать работу', 'Сменить партию', 'Мои данные', 'Изменить показания'],
-        'Горло': ['Начать работу', 'Сменить партию', 'Мои данные', 'Изменить показания'],
-        'Утюг': ['Начать работу', 'Сменить партию', 'Мои данные', 'Изменить показания'],
-        'OTK': ['Начать работу', 'Сменить партию', 'Мои данные', 'Изменить показания'],
-        'Упаковка': ['Начать работу', 'Сменить партию', 'Мои данные', 'Изменить показания']
-    }
-
-    # Если должность не найдена
-    if normalized_job not in job_actions:
-        print(f"⚠️ Должность '{job}' -> '{normalized_job}' не найдена в списке действий")
-
-        # Возвращаем меню с базовыми кнопками
-        keyboard = [
-            [KeyboardButton(text='Начать работу')],
-            [KeyboardButton(text='Сменить партию')],
-            [KeyboardButton(text='Мои данные')]
-        ]
-        return ReplyKeyboardMarkup(keyboard=keyboard, resize_keyboard=True)
-
-    keyboard = []
-    for action in job_actions.get(normalized_job, []):
-        keyboard.append([KeyboardButton(text=action)])
+    keyboard = MAIN_MENU_KEYBOARDS.get(job)
+    if keyboard is not None:
+        return keyboard
 
-    return ReplyKeyboardMarkup(keyboard=keyboard, resize_keyboard=True)
+    # Должность записана иначе (например, в другом регистре)
+    role = Role.from_job(job)
+    if role is not None:
+        return MAIN_MENU_KEYBOARDS[role]
+
+    print(f"⚠️ Должность '{job}' не найдена в списке действий")
+    return DEFAULT_MAIN_MENU_KEYBOARD
 
 
 def get_materials_management_keyboard(materials, party_id, user_job):
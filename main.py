@@ -1,10 +1,12 @@
 import asyncio
 from aiogram import Bot, Dispatcher, F
-from aiogram.filters import CommandStart, Command
+from aiogram.filters import CommandStart, Command, ExceptionTypeFilter
 from aiogram.fsm.storage.memory import MemoryStorage
 
-from config import BOT_TOKEN, DB_HOST, DB_PORT, DB_NAME
+from config import BOT_TOKEN, DB_HOST, DB_PORT, DB_NAME, FSM_STORAGE, USER_QUEUE_SIZE
 from db import db
+from storage import PostgresStorage, UserEventIsolation, UserQueueFull, FSMDataTooLarge
+from middlewares import UserContextMiddleware, RegistrationGuardMiddleware
 
 # Импортируем все обработчики
 from handlers.common import (
@@ -15,7 +17,8 @@ from handlers.common import (
     new_record_handler, start_work_handler,
     change_party_handler, my_stats_handler, all_parties_handler, change_machine_command, manage_users_handler,
     manage_users_command, manage_parties_handler, check_my_data, back_to_parties, add_material_callback,
-    continue_work_callback, change_party_callback, edit_operations_handler, check_db_data
+    continue_work_callback, change_party_callback, edit_operations_handler, check_db_data,
+    cache_stats_command, user_queue_full_handler, fsm_data_too_large_handler
 )
 from handlers.edit_operations import (
     edit_party_selected, edit_color_selected,
@@ -86,14 +89,27 @@ from handlers.material_management import (
 )
 
 from handlers.edit_operations import edit_count_handler
+from handlers.bulk_import import import_command, import_file_handler
 
 # Импортируем состояния
 from states import *
 
 # Инициализация
 bot = Bot(token=BOT_TOKEN)
-storage = MemoryStorage()
-dp = Dispatcher(storage=storage)
+# Состояния FSM в БД переживают перезапуск; пул создается в main() до первого апдейта
+storage = PostgresStorage(db) if FSM_STORAGE == 'postgres' else MemoryStorage()
+# Апдейты одного пользователя - по очереди (без двойных записей), разных - параллельно
+dp = Dispatcher(storage=storage, events_isolation=UserEventIsolation(USER_QUEUE_SIZE))
+dp.errors.register(user_queue_full_handler, ExceptionTypeFilter(UserQueueFull))
+dp.errors.register(fsm_data_too_large_handler, ExceptionTypeFilter(FSMDataTooLarge))
+
+# Пользователь и его должность - один раз на апдейт, до фильтров и обработчиков
+dp.message.outer_middleware(UserContextMiddleware())
+dp.callback_query.outer_middleware(UserContextMiddleware())
+# Незарегистрированным отвечаем сразу, без обработчиков и запросов к БД
+registration_guard = RegistrationGuardMiddleware()
+dp.message.outer_middleware(registration_guard)
+dp.callback_query.outer_middleware(registration_guard)
 
 # ========== РЕГИСТРАЦИЯ ОБРАБОТЧИКОВ ==========
 
@@ -106,6 +122,8 @@ dp.message.register(reset_command, Command("reset"))
 dp.message.register(info_command, Command("инфо"))
 dp.message.register(new_party_command, Command("новая_партия"))
 dp.message.register(check_my_data, Command("мои_данные"))
+dp.message.register(import_command, Command("импорт"))
+dp.message.register(import_file_handler, ImportStates.waiting_for_file)
 
 
 # Регистрация
@@ -179,6 +197,7 @@ dp.callback_query.register(edit_party_selected, F.data.startswith("party_"), Edi
 dp.callback_query.register(edit_color_callback, F.data.startswith("edit_color_"))
 dp.callback_query.register(edit_color_selected, F.data.startswith("edit_count_"), EditOperationsStates.waiting_for_color_selection)
 dp.message.register(check_db_data, Command("проверка"))
+dp.message.register(cache_stats_command, Command("кэш"))
 dp.message.register(edit_count_handler, EditOperationsStates.waiting_for_new_count)
 
 # 4-х
@@ -246,12 +265,12 @@ dp.callback_query.register(new_party_callback, F.data == "new_party")
 
 # ========== ЗАПУСК БОТА ==========
 async def main():
+    # Применяем миграции схемы (под advisory lock - безопасно для нескольких экземпляров)
+    await db.migrate()
+
     # Создаем пул подключений к БД
     await db.create_pool()
 
-    # Автоматически создаем таблицы если их нет
-    await db.create_tables_if_not_exist()
-
     # Проверяем подключение
     print("=" * 50)
     print("🤖 Бот запускается...")
@@ -271,7 +290,10 @@ async def main():
     print("=" * 50)
 
     # Запускаем бота
-    await dp.start_polling(bot)
+    try:
+        await dp.start_polling(bot)
+    finally:
+        await db.close_pool()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,74 @@
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import CallbackQuery, Message, TelegramObject
+
+from config import ZAKROISHCHIK_ID
+from db import db
+from states import RegistrationStates
+
+
+class UserContextMiddleware(BaseMiddleware):
+    """Один раз на апдейт находит пользователя и передает его обработчику.
+
+    Обработчик получает user (запись из users или None, если не
+    зарегистрирован), просто объявив параметр с таким именем. Роль
+    пользователя (Role) - в user['role'].
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        from_user = data.get('event_from_user')
+        user = await db.get_user(from_user.id) if from_user else None
+
+        data['user'] = user
+        return await handler(event, data)
+
+
+class RegistrationGuardMiddleware(BaseMiddleware):
+    """Отвечает незарегистрированным пользователям сразу, не доходя до обработчиков.
+
+    Ставится после UserContextMiddleware. Пропускает /start, /reset, /отмена,
+    шаги регистрации и закройщика (он регистрируется автоматически).
+    """
+
+    ALLOWED_COMMANDS = {'start', 'reset', 'отмена'}
+    REGISTRATION_STATES = {state.state for state in RegistrationStates.__states__}
+
+    def __init__(self):
+        self.rejected = 0
+
+    def _is_allowed(self, event: TelegramObject, data: Dict[str, Any]) -> bool:
+        from_user = data.get('event_from_user')
+        if from_user is None or from_user.id == ZAKROISHCHIK_ID:
+            return True
+
+        if data.get('raw_state') in self.REGISTRATION_STATES:
+            return True
+
+        if isinstance(event, Message) and event.text and event.text.startswith('/'):
+            # /start, /start@имя_бота и /start с параметром
+            command = event.text[1:].split(maxsplit=1)[0].split('@', 1)[0]
+            return command in self.ALLOWED_COMMANDS
+
+        return False
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        if data.get('user') is not None or self._is_allowed(event, data):
+            return await handler(event, data)
+
+        self.rejected += 1
+        if isinstance(event, CallbackQuery):
+            await event.answer("Сначала пройдите регистрацию через /start", show_alert=True)
+        elif isinstance(event, Message):
+            await event.answer("Сначала пройдите регистрацию через /start")
+        return None
@@ -0,0 +1,288 @@
+import asyncio
+
+import asyncpg
+
+from db import STAGE_COLUMNS, STAGE_USER_COLUMNS
+
+# Ключ advisory lock: пока один экземпляр бота мигрирует, остальные ждут
+MIGRATIONS_LOCK_KEY = 730211401
+
+
+class Migration:
+    """Одна версия схемы.
+
+    transactional=False нужен для CREATE INDEX CONCURRENTLY, который нельзя
+    выполнять внутри транзакции - такие миграции должны быть идемпотентными.
+    """
+
+    def __init__(self, version: int, description: str, statements=(), apply=None, transactional=True):
+        self.version = version
+        self.description = description
+        self.statements = statements
+        self.apply = apply
+        self.transactional = transactional
+
+    async def run(self, conn):
+        for statement in self.statements:
+            await conn.execute(statement)
+        if self.apply:
+            await self.apply(conn)
+
+
+async def backfill_work_entries(conn):
+    """Перенос существующих показаний из колонок materials в журнал работ"""
+    has_entries = await conn.fetchval("SELECT EXISTS (SELECT 1 FROM work_entries)")
+    if has_entries:
+        return
+
+    for stage, (worker_column, count_column) in STAGE_COLUMNS.items():
+        await conn.execute(f"""
+            INSERT INTO work_entries (material_id, stage, user_id, count, recorded_at)
+            SELECT m.id, '{stage}', u.id, m.{count_column}, m.created_at
+            FROM materials m
+            JOIN LATERAL (
+                SELECT id FROM users
+                WHERE lower(trim(name)) = lower(trim(m.{worker_column}))
+                ORDER BY id LIMIT 1
+            ) u ON TRUE
+            WHERE m.{count_column} IS NOT NULL
+        """)
+
+    total = await conn.fetchval("SELECT COUNT(*) FROM work_entries")
+    print(f"📋 Журнал работ заполнен из materials: {total} записей")
+
+
+async def add_stage_user_columns(conn):
+    """Ссылки на исполнителей этапов вместо поиска по имени.
+
+    Колонки с именами остаются для отображения, а существующие имена
+    сопоставляются с users так же, как при заполнении журнала работ.
+    """
+    for stage, (worker_column, _) in STAGE_COLUMNS.items():
+        user_column = STAGE_USER_COLUMNS[stage]
+        await conn.execute(f"""
+            ALTER TABLE materials ADD COLUMN IF NOT EXISTS {user_column} INTEGER 
+            REFERENCES users(id) ON DELETE SET NULL
+        """)
+        await conn.execute(f"""
+            UPDATE materials m SET {user_column} = (
+                SELECT id FROM users
+                WHERE lower(trim(name)) = lower(trim(m.{worker_column}))
+                ORDER BY id LIMIT 1
+            )
+            WHERE m.{worker_column} IS NOT NULL AND m.{user_column} IS NULL
+        """)
+
+    unmatched = await conn.fetchval(
+        "SELECT COUNT(*) FROM materials WHERE "
+        + " OR ".join(
+            f"({worker_column} IS NOT NULL AND {STAGE_USER_COLUMNS[stage]} IS NULL)"
+            for stage, (worker_column, _) in STAGE_COLUMNS.items()
+        )
+    )
+    if unmatched:
+        print(f"⚠️ Материалов с исполнителями, не найденными среди пользователей: {unmatched}")
+
+
+async def drop_trgm_extension(conn):
+    """Удалить pg_trgm, только если от него больше ничего не зависит.
+
+    Расширение могли поставить не для бота. DROP EXTENSION без CASCADE сам
+    проверяет зависимости по pg_depend и отказывает, если расширением
+    пользуются другие объекты - тогда оставляем его и продолжаем запуск.
+    """
+    try:
+        await conn.execute("DROP EXTENSION IF EXISTS pg_trgm RESTRICT")
+    except asyncpg.DependentObjectsStillExistError as e:
+        print(f"⚠️ pg_trgm используется другими объектами БД - расширение оставлено ({e.detail or e})")
+
+
+async def create_stage_user_indexes(conn):
+    for user_column in STAGE_USER_COLUMNS.values():
+        await conn.execute(
+            f"CREATE INDEX CONCURRENTLY IF NOT EXISTS materials_{user_column}_idx "
+            f"ON materials ({user_column}) WHERE {user_column} IS NOT NULL"
+        )
+
+
+MIGRATIONS = [
+    Migration(1, "Базовые таблицы parties, materials, users", statements=(
+        """
+        CREATE TABLE IF NOT EXISTS parties (
+            id SERIAL PRIMARY KEY,
+            batch_number VARCHAR(50) UNIQUE NOT NULL,
+            design VARCHAR(100),
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS materials (
+            id SERIAL PRIMARY KEY,
+            party_id INTEGER NOT NULL REFERENCES parties(id) ON DELETE CASCADE,
+            color VARCHAR(100),
+            quantity_line INTEGER,
+            tshirt_count INTEGER,
+            four_x VARCHAR(100),
+            four_x_count INTEGER,
+            raspash VARCHAR(100),
+            raspash_count INTEGER,
+            beika VARCHAR(100),
+            beika_count INTEGER,
+            strochka VARCHAR(100),
+            strochka_count INTEGER,
+            gorlo VARCHAR(100),
+            gorlo_count INTEGER,
+            ytyg VARCHAR(100),
+            ytyg_count INTEGER,
+            otk VARCHAR(100),
+            otk_count INTEGER,
+            ypakovka VARCHAR(100),
+            ypakovka_count INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            id SERIAL PRIMARY KEY,
+            tg_id BIGINT UNIQUE NOT NULL,
+            name VARCHAR(100) NOT NULL,
+            job VARCHAR(50) NOT NULL,
+            machine_number VARCHAR(100),
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+    )),
+    Migration(2, "Журнал работ work_entries", statements=(
+        """
+        CREATE TABLE IF NOT EXISTS work_entries (
+            id BIGSERIAL PRIMARY KEY,
+            material_id INTEGER NOT NULL REFERENCES materials(id) ON DELETE CASCADE,
+            stage VARCHAR(20) NOT NULL,
+            user_id INTEGER REFERENCES users(id) ON DELETE SET NULL,
+            count INTEGER NOT NULL,
+            recorded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS work_entries_material_stage_idx ON work_entries (material_id, stage)",
+        "CREATE INDEX IF NOT EXISTS work_entries_user_stage_idx ON work_entries (user_id, stage)",
+    ), apply=backfill_work_entries),
+    # Раньше ставила pg_trgm для поиска по ILIKE; поиск заменен ссылками на
+    # users.id (миграция 5). Пустая версия оставлена, чтобы номера не сдвигались
+    Migration(3, "Пустая версия (номер сохранен для нумерации миграций)"),
+    Migration(4, "Индексы по внешним ключам", statements=(
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS materials_party_id_idx ON materials (party_id)",
+    ), transactional=False),
+    Migration(5, "Ссылки на исполнителей этапов в materials", apply=add_stage_user_columns),
+    Migration(6, "Индексы по исполнителям этапов", apply=create_stage_user_indexes, transactional=False),
+    Migration(7, "Состояния FSM fsm_states", statements=(
+        """
+        CREATE TABLE IF NOT EXISTS fsm_states (
+            storage_key TEXT PRIMARY KEY,
+            state VARCHAR(200),
+            data JSONB NOT NULL DEFAULT '{}'::jsonb,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+    )),
+    Migration(8, "Текущая партия пользователя users.last_party_id", statements=(
+        "ALTER TABLE users ADD COLUMN IF NOT EXISTS last_party_id INTEGER "
+        "REFERENCES parties(id) ON DELETE SET NULL",
+    )),
+    Migration(9, "Время жизни состояний FSM", statements=(
+        "ALTER TABLE fsm_states ADD COLUMN IF NOT EXISTS expires_at TIMESTAMP",
+        # Уже сохраненные состояния получают сутки с последнего изменения
+        "UPDATE fsm_states SET expires_at = updated_at + interval '1 day' WHERE expires_at IS NULL",
+        "CREATE INDEX IF NOT EXISTS fsm_states_expires_at_idx ON fsm_states (expires_at)",
+    )),
+    # users.tg_id уникален - его индекс уже есть, второй только замедлял запись
+    Migration(10, "Удаление дублирующего индекса users_tg_id_idx", statements=(
+        "DROP INDEX CONCURRENTLY IF EXISTS users_tg_id_idx",
+    ), transactional=False),
+    # Читателей у GIN-индексов по именам не осталось, а four_x и raspash
+    # меняются при каждой записи показаний
+    Migration(11, "Удаление GIN-индексов по именам и неиспользуемого pg_trgm", statements=(
+        "DROP INDEX CONCURRENTLY IF EXISTS users_name_trgm_idx",
+        "DROP INDEX CONCURRENTLY IF EXISTS materials_four_x_trgm_idx",
+        "DROP INDEX CONCURRENTLY IF EXISTS materials_raspash_trgm_idx",
+    ), apply=drop_trgm_extension, transactional=False),
+]
+
+
+async def get_invalid_indexes(conn):
+    """Индексы, оставшиеся INVALID после прерванного CREATE INDEX CONCURRENTLY"""
+    rows = await conn.fetch("""
+        SELECT c.relname FROM pg_index i
+        JOIN pg_class c ON c.oid = i.indexrelid
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE NOT i.indisvalid AND n.nspname = current_schema()
+    """)
+    return [row['relname'] for row in rows]
+
+
+async def drop_invalid_indexes(conn):
+    """Удалить недостроенные индексы, иначе IF NOT EXISTS их пропустит"""
+    for name in await get_invalid_indexes(conn):
+        print(f"⚠️ Индекс {name} недостроен (INVALID) - удаляем и строим заново")
+        await conn.execute(f'DROP INDEX CONCURRENTLY IF EXISTS "{name}"')
+
+
+async def acquire_migrations_lock(conn, poll_interval: float = 0.5):
+    """Взять advisory lock без блокирующего запроса.
+
+    Ждущий pg_advisory_lock() держит снимок, и CREATE INDEX CONCURRENTLY
+    у мигрирующего экземпляра ждал бы его - поэтому опрашиваем try-lock.
+    """
+    while not await conn.fetchval("SELECT pg_try_advisory_lock($1)", MIGRATIONS_LOCK_KEY):
+        await asyncio.sleep(poll_interval)
+
+
+async def run_migrations(conn):
+    """Применить все неприменённые миграции по порядку версий"""
+    await acquire_migrations_lock(conn)
+
+    try:
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                description TEXT,
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+
+        applied = {
+            row['version'] for row in await conn.fetch("SELECT version FROM schema_version")
+        }
+
+        for migration in sorted(MIGRATIONS, key=lambda m: m.version):
+            if migration.version in applied:
+                continue
+
+            print(f"🛠️ Миграция {migration.version}: {migration.description}")
+
+            if migration.transactional:
+                async with conn.transaction():
+                    await migration.run(conn)
+                    await conn.execute(
+                        "INSERT INTO schema_version (version, description) VALUES ($1, $2)",
+                        migration.version, migration.description
+                    )
+            else:
+                # Прошлая попытка могла упасть посреди CREATE INDEX CONCURRENTLY
+                await drop_invalid_indexes(conn)
+                await migration.run(conn)
+
+                invalid = await get_invalid_indexes(conn)
+                if invalid:
+                    raise RuntimeError(
+                        f"Миграция {migration.version} оставила недостроенные индексы: "
+                        f"{', '.join(invalid)}"
+                    )
+                await conn.execute(
+                    "INSERT INTO schema_version (version, description) VALUES ($1, $2)",
+                    migration.version, migration.description
+                )
+
+        version = await conn.fetchval("SELECT MAX(version) FROM schema_version")
+        print(f"Схема БД актуальна (версия {version})")
+    finally:
+        await conn.execute("SELECT pg_advisory_unlock($1)", MIGRATIONS_LOCK_KEY)
@@ -0,0 +1,68 @@
+from enum import Enum
+
+
+# Словарь для преобразования должностей (синхронный)
+JOB_TRANSLATION = {
+    'zakroi': 'Закрой',
+    'Закрой': 'Закрой',
+    'fourx': '4-х',
+    '4-х': '4-х',
+    'raspash': 'Распаш',
+    'Распаш': 'Распаш',
+    'beika': 'Бейка',
+    'Бейка': 'Бейка',
+    'strochka': 'Строчка',
+    'Строчка': 'Строчка',
+    'gorlo': 'Горло',
+    'Горло': 'Горло',
+    'ytyg': 'Утюг',
+    'Утюг': 'Утюг',
+    'otk': 'OTK',
+    'OTK': 'OTK',
+    'upakovka': 'Упаковка',
+    'Упаковка': 'Упаковка'
+}
+
+
+class Role(str, Enum):
+    """Должность в нормализованном виде. Значение совпадает с названием
+    должности в БД, поэтому роль можно сравнивать и со строкой"""
+    ZAKROI = 'Закрой'
+    FOUR_X = '4-х'
+    RASPASH = 'Распаш'
+    BEIKA = 'Бейка'
+    STROCHKA = 'Строчка'
+    GORLO = 'Горло'
+    YTYG = 'Утюг'
+    OTK = 'OTK'
+    UPAKOVKA = 'Упаковка'
+
+    @classmethod
+    def from_job(cls, job):
+        """Роль по должности в любом написании; None - должность неизвестна"""
+        if not job:
+            return None
+        role = _ROLE_BY_JOB.get(job)
+        if role is None:
+            role = _ROLE_BY_FOLDED_JOB.get(job.casefold())
+        return role
+
+
+# Точное написание и регистронезависимый индекс: поиск роли за один get
+_ROLE_BY_JOB = {key: Role(value) for key, value in JOB_TRANSLATION.items()}
+_ROLE_BY_FOLDED_JOB = {key.casefold(): role for key, role in _ROLE_BY_JOB.items()}
+
+
+# Синхронная функция нормализации должности
+def normalize_job_sync(job: str) -> str:
+    """Синхронно приводит должность к стандартному виду"""
+    role = Role.from_job(job)
+
+    # Если не нашли, возвращаем как есть
+    return role.value if role else job
+
+
+# Синхронная функция проверки закройщика
+def is_zakroi_sync(job: str) -> bool:
+    """Синхронно проверяет является ли должность закройщиком"""
+    return Role.from_job(job) is Role.ZAKROI
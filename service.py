@@ -1,5 +1,8 @@
+from cache import TTLCache
+from config import PARTY_CACHE_TTL, COLORS_CACHE_SIZE, REPORT_CACHE_SIZE
 from db import db
 from keyboards import get_parties_keyboard, get_colors_keyboard
+from roles import Role
 
 
 class UserService:
@@ -22,26 +25,24 @@ class UserService:
     @staticmethod
     async def update_user_machine_number(tg_id: int, machine_number: str):
         """Обновить номер машинки пользователя"""
-        if not db.pool:
-            await db.create_pool()
-
-        async with db.pool.acquire() as conn:
-            await conn.execute(
-                """
-                UPDATE users 
-                SET machine_number = $1 
-                WHERE tg_id = $2
-                """,
-                machine_number, tg_id
-            )
-            return True
+        return await db.update_user_machine_number(tg_id, machine_number)
 
     @staticmethod
     def is_zakroi_sync(job: str) -> bool:
         """СИНХРОННО проверяет является ли должность закройщиком"""
-        from keyboards import is_zakroi_sync as check_zakroi
+        from roles import is_zakroi_sync as check_zakroi
         return check_zakroi(job)
 
+    @staticmethod
+    async def get_current_party(tg_id: int):
+        """Номер текущей партии пользователя или None"""
+        return await db.get_current_party(tg_id)
+
+    @staticmethod
+    def set_current_party(tg_id: int, batch_number: str):
+        """Запомнить текущую партию (в БД запишется отложенно)"""
+        db.set_current_party(tg_id, batch_number)
+
     @staticmethod
     async def get_user_display_info(tg_id: int):
         """Получить отображаемую информацию о пользователе"""
@@ -52,7 +53,7 @@ class UserService:
         display_name = user['name']
 
         # Для 4-х оператора добавляем номер машинки
-        if user['job'] == '4-х' and user.get('machine_number'):
+        if user['role'] is Role.FOUR_X and user.get('machine_number'):
             display_name = f"{user['name']} ({user['machine_number']})"
 
         return display_name, user['job']
@@ -77,25 +78,47 @@ class PartyService:
             return success
         else:
             # Обновляем дизайн существующей партии
-            async with db.pool.acquire() as conn:
-                await conn.execute(
-                    "UPDATE parties SET design = $1 WHERE batch_number = $2",
-                    design, batch_number
-                )
-            return True
+            return await db.update_party_design(batch_number, design)
+
+    # Готовые тексты отчетов по (вид, ID партии, версия данных партии)
+    reports = TTLCache('party_reports', REPORT_CACHE_SIZE, PARTY_CACHE_TTL)
+
+    @staticmethod
+    async def _cached_report(kind: str, party_id: int, build):
+        key = (kind, party_id, db.get_party_version(party_id))
+
+        text = PartyService.reports.get(key)
+        if text is None:
+            text = await build()
+            # Пока строили, партию изменили - такой текст не кэшируем
+            if key[2] == db.get_party_version(party_id):
+                PartyService.reports.set(key, text)
+        return text
 
     @staticmethod
     async def format_party_info_detailed(party_id: int, user_job=None):
         """Детальное форматирование информации о партии"""
-        party = await db.get_party_by_id(party_id)
-        materials = await db.get_materials_by_party(party_id)
+        async def build():
+            rows = await db.get_party_report(party_id)
+            return PartyService.render_party_report(rows)
+
+        return await PartyService._cached_report('detailed', party_id, build)
+
+    @staticmethod
+    def render_party_report(rows):
+        """Текст отчета по строкам get_party_report, без обращений к БД"""
+        if not rows:
+            return "Партия не найдена"
+
+        party = rows[0]
+        materials = [row for row in rows if row['id'] is not None]
+
+        design_text = f"({party['party_design']})" if party['party_design'] else ""
 
         if not materials:
-            design_text = f"({party.get('design')})" if party.get('design') else ""
             return f"📦 Партия №{party['batch_number']}{design_text}\n\nВ этой партии пока нет материалов"
 
         # Заголовок с дизайном
-        design_text = f"({party.get('design')})" if party.get('design') else ""
         result = f"📦 Партия №{party['batch_number']}{design_text}\n\n"
 
         material_number = 1
@@ -122,8 +145,7 @@ class PartyService:
                 if op_person and op_count:
                     # Для 4-х оператора добавляем номер машинки
                     if op_name == '4-х':
-                        user = await db.get_user_by_name(op_person)
-                        machine = f"({user['machine_number']})" if user and user.get('machine_number') else ""
+                        machine = f"({material['four_x_machine']})" if material['four_x_machine'] else ""
                         result += f"       {op_name}({op_person}{machine}): {op_count}шт\n"
                     else:
                         result += f"       {op_name}({op_person}): {op_count}шт\n"
@@ -143,8 +165,15 @@ class PartyService:
     @staticmethod
     async def format_party_simple(party_id: int, user_job=None):
         """Упрощенный вид партии для операторов"""
-        materials = await db.get_materials_by_party(party_id)
+        async def build():
+            materials = await db.get_materials_by_party(party_id)
+            return PartyService.render_party_simple(materials)
 
+        return await PartyService._cached_report('simple', party_id, build)
+
+    @staticmethod
+    def render_party_simple(materials):
+        """Текст упрощенного вида по материалам партии, без обращений к БД"""
         if not materials:
             return "В этой партии пока нет материалов"
 
@@ -174,7 +203,7 @@ class PartyService:
     def get_party_keyboard(party_id: int, batch_number: str, user_job=None, show_add_more=False):
         """Создать клавиатуру для партии"""
         from aiogram.utils.keyboard import InlineKeyboardBuilder
-        from keyboards import is_zakroi_sync
+        from roles import is_zakroi_sync
 
         builder = InlineKeyboardBuilder()
 
@@ -219,21 +248,40 @@ class PartyService:
         return builder.as_markup()
 
 class KeyboardService:
+    # Готовые клавиатуры партий по (версия списка партий, роль, с управлением)
+    parties_keyboards = TTLCache('party_keyboards', 32, PARTY_CACHE_TTL)
+    # Клавиатуры цветов по (ID партии, версия состава материалов партии)
+    colors_keyboards = TTLCache('color_keyboards', COLORS_CACHE_SIZE, PARTY_CACHE_TTL)
+
     @staticmethod
     async def get_parties_keyboard(user_job=None, with_management=False):
-        parties = await db.get_all_parties()
-        return get_parties_keyboard(parties, user_job, with_management)
+        # Клавиатура отличается только для закройщика - остальные должности делят одну
+        role = Role.ZAKROI if Role.from_job(user_job) is Role.ZAKROI else None
+        key = (db.parties_version, role, with_management)
+
+        keyboard = KeyboardService.parties_keyboards.get(key)
+        if keyboard is None:
+            parties = await db.get_all_parties()
+            keyboard = get_parties_keyboard(parties, role, with_management)
+            # Пока читали список, партии могли измениться - такую не кэшируем
+            if key[0] == db.parties_version:
+                KeyboardService.parties_keyboards.set(key, keyboard)
+        return keyboard
 
     @staticmethod
     async def get_colors_keyboard(party_id: int):
-        materials = await db.get_materials_by_party(party_id)
-        return get_colors_keyboard(materials)
+        key = (party_id, db.materials_versions[party_id])
+
+        keyboard = KeyboardService.colors_keyboards.get(key)
+        if keyboard is None:
+            materials = await db.get_materials_by_party(party_id)
+            keyboard = get_colors_keyboard(materials)
+            if key[1] == db.materials_versions[party_id]:
+                KeyboardService.colors_keyboards.set(key, keyboard)
+        return keyboard
 
 
 # СОЗДАЕМ ЭКЗЕМПЛЯРЫ КЛАССОВ
 user_service = UserService()
 party_service = PartyService()
 keyboard_service = KeyboardService()
-
-# Глобальное хранилище сессий
-user_sessions = {}
\ No newline at end of file
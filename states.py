@@ -1,6 +1,8 @@
 # states.py
 from aiogram.fsm.state import State, StatesGroup
 
+from config import FSM_STATE_TTL, FSM_INPUT_STATE_TTL
+
 class RegistrationStates(StatesGroup):
     waiting_for_name = State()
     waiting_for_job = State()
@@ -21,6 +23,9 @@ class ZakroiStates(StatesGroup):
 class MaterialManagementStates(StatesGroup):
     waiting_for_confirmation = State()
 
+class ImportStates(StatesGroup):
+    waiting_for_file = State()
+
 # Состояния для управления партиями
 class PartyManagementStates(StatesGroup):
     waiting_for_action = State()  # Выбор действия
@@ -74,4 +79,27 @@ class EditOperationsStates(StatesGroup):
     waiting_for_party_selection = State()
     waiting_for_color_selection = State()
     waiting_for_operation = State()
-    waiting_for_new_count = State()
\ No newline at end of file
+    waiting_for_new_count = State()
+
+
+# Время жизни состояния (сек): ожидание количества - FSM_INPUT_STATE_TTL,
+# остальные - FSM_STATE_TTL. Продлевается при каждой записи состояния или данных
+STATE_TTLS = {
+    state.state: FSM_INPUT_STATE_TTL
+    for state in (
+        ZakroiStates.waiting_for_quantity_line,
+        FourXStates.waiting_for_count,
+        RaspashStates.waiting_for_count,
+        BeikaStates.waiting_for_count,
+        StrochkaStates.waiting_for_count,
+        GorloStates.waiting_for_count,
+        YtygStates.waiting_for_count,
+        OtkStates.waiting_for_count,
+        UpakovkaStates.waiting_for_count,
+        EditOperationsStates.waiting_for_new_count,
+    )
+}
+
+
+def get_state_ttl(state) -> float:
+    return STATE_TTLS.get(state, FSM_STATE_TTL)
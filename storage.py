@@ -0,0 +1,130 @@
+import asyncio
+import json
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncGenerator, Dict, Mapping, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import (
+    BaseEventIsolation, BaseStorage, DefaultKeyBuilder, KeyBuilder, StateType, StorageKey
+)
+
+
+class PostgresStorage(BaseStorage):
+    """Хранилище FSM в таблице fsm_states на общем пуле db.
+
+    Незавершенные сценарии переживают перезапуск бота и видны всем его
+    экземплярам. Чтения идут из кэша db.fsm_cache, запись сквозная:
+    сначала upsert в БД, затем кэш.
+    """
+
+    def __init__(self, database, key_builder: Optional[KeyBuilder] = None):
+        self.database = database
+        self.key_builder = key_builder or DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        state = state.state if isinstance(state, State) else state
+        await self.database.set_fsm_state(self.key_builder.build(key), state)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        state, _ = await self.database.get_fsm(self.key_builder.build(key))
+        return state
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        await self.database.set_fsm_data(self.key_builder.build(key), dict(data))
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        # Каждый раз новый словарь из JSON - изменения обработчика не попадут в кэш
+        _, data = await self.database.get_fsm(self.key_builder.build(key))
+        return json.loads(data)
+
+    async def close(self) -> None:
+        # Пул закрывает db.close_pool()
+        pass
+
+
+class UserQueueFull(Exception):
+    """У пользователя уже слишком много апдейтов в очереди"""
+
+    def __init__(self, key: StorageKey):
+        super().__init__(f"Очередь апдейтов пользователя {key.user_id} в чате {key.chat_id} переполнена")
+        self.key = key
+
+
+class FSMDataTooLarge(Exception):
+    """Данные FSM больше предела FSM_MAX_DATA_SIZE - обычно слишком длинный текст от пользователя"""
+
+    def __init__(self, storage_key: str, size: int, limit: int, keys):
+        super().__init__(
+            f"Данные FSM для {storage_key} занимают {size} байт "
+            f"(предел {limit}): ключи {', '.join(keys)}"
+        )
+        self.storage_key = storage_key
+        self.size = size
+
+
+class UserEventIsolation(BaseEventIsolation):
+    """Апдейты одного пользователя в чате выполняются строго по очереди.
+
+    Замок берется в FSMContextMiddleware до чтения состояния, поэтому
+    повторное нажатие кнопки или второе быстрое сообщение видят состояние,
+    уже измененное первым. Разные пользователи не ждут друг друга.
+    В очереди одного пользователя не больше max_queue апдейтов сверх
+    выполняемого - лишние отклоняются через UserQueueFull.
+    """
+
+    def __init__(self, max_queue: int):
+        self.max_queue = max_queue
+        # Ключ -> [замок, сколько апдейтов его держат или ждут]; запись
+        # удаляется, когда очередь пуста, - память не растет с числом пользователей
+        self._locks = {}
+        self.acquired = 0
+        self.waited = 0
+        self.wait_time = 0.0
+        self.max_wait = 0.0
+        self.rejected = 0
+
+    @asynccontextmanager
+    async def lock(self, key: StorageKey) -> AsyncGenerator[None, None]:
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        elif entry[1] > self.max_queue:
+            self.rejected += 1
+            raise UserQueueFull(key)
+
+        lock = entry[0]
+        entry[1] += 1
+        try:
+            if lock.locked():
+                started = time.monotonic()
+                await lock.acquire()
+                waited = time.monotonic() - started
+                self.waited += 1
+                self.wait_time += waited
+                self.max_wait = max(self.max_wait, waited)
+            else:
+                await lock.acquire()
+            self.acquired += 1
+
+            try:
+                yield
+            finally:
+                lock.release()
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[key]
+
+    def stats(self):
+        return {
+            'active': len(self._locks),
+            'acquired': self.acquired,
+            'waited': self.waited,
+            'avg_wait': self.wait_time / self.waited if self.waited else 0.0,
+            'max_wait': self.max_wait,
+            'rejected': self.rejected,
+        }
+
+    async def close(self) -> None:
+        self._locks.clear()